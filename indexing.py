@@ -1,19 +1,29 @@
 import os
 import sys
+import gzip
+import queue
+import shutil
+import tempfile
+import multiprocessing
 
 import lucene
 from tqdm import tqdm
 import time
-from datetime import datetime
+import json
+from datetime import datetime, timezone
 
 from utils import dblp
+from utils.metrics import IndexMetrics
+from utils.keyphrases import createRake, titleKeyphrases
 from lxml import etree
 from java.util import HashMap
 from org.apache.lucene.analysis.standard import StandardTokenizer
 from org.apache.lucene.analysis import LowerCaseFilter, StopFilter
 from org.apache.lucene.analysis.en import PorterStemFilter, EnglishAnalyzer
-from org.apache.lucene.document import Document, Field, StringField, FieldType, TextField, IntPoint, SortedNumericDocValuesField, LongPoint, StoredField, NumericDocValuesField
-from org.apache.lucene.index import IndexWriter, IndexWriterConfig, IndexOptions
+from org.apache.lucene.document import Document, Field, StringField, FieldType, TextField, IntPoint, SortedNumericDocValuesField, LongPoint, StoredField, NumericDocValuesField, SortedDocValuesField, SortedSetDocValuesField
+from org.apache.lucene.index import IndexWriter, IndexWriterConfig, IndexOptions, DirectoryReader, Term, SegmentInfos, TieredMergePolicy
+from org.apache.lucene.search import DocIdSetIterator
+from org.apache.lucene.util import BytesRef
 from org.apache.lucene.store import FSDirectory
 from org.apache.lucene.analysis.miscellaneous import PerFieldAnalyzerWrapper
 from java.io import File
@@ -77,6 +87,34 @@ string_field = {
     'volume',
 }
 
+# IndexWriterConfig settings, selected with Indexer(profile=...) or --profile
+#   ram_buffer_mb: RAM used to buffer documents before a segment is flushed
+#   compound: pack each segment into a compound file
+#   segments_per_tier, max_merged_segment_mb: TieredMergePolicy settings
+#   force_merge: merge the index down to this many segments in Indexer.ending
+#   maxheap: JVM heap, has to fit the RAM buffer
+# worker processes of a parallel build share them, see profileSettings
+writer_profiles = {
+    "default": {},
+    # fastest build: large buffer, few and wide merges, no compound files
+    "bulk": {
+        "ram_buffer_mb": 1024,
+        "compound": False,
+        "segments_per_tier": 20,
+        "max_merged_segment_mb": 10 * 1024,
+        "maxheap": "4g",
+    },
+    # bulk build followed by a merge to one segment, for the fastest searches
+    "search": {
+        "ram_buffer_mb": 1024,
+        "compound": False,
+        "segments_per_tier": 20,
+        "max_merged_segment_mb": 10 * 1024,
+        "force_merge": 1,
+        "maxheap": "4g",
+    },
+}
+
 # create a analyzer class, use to turn string -> token
 class CustomAnalyzer(EnglishAnalyzer):
     def __init__(self):
@@ -99,174 +137,798 @@ class CustomAnalyzer(EnglishAnalyzer):
         return wrapper
 
 
+def profileSettings(profile: str = "default", share: int = 1):
+    """Settings of a writer profile for one of share processes building in parallel
+
+    The RAM buffer and the JVM heap of the profile are split between the
+    processes, so that a parallel build needs about as much memory as a
+    serial one.
+
+    Args:
+        profile: name of the writer_profiles entry
+        share: number of processes running a writer with this profile
+
+    Return:
+        dict: writer_profiles entry, scaled down if share > 1
+    """
+    settings = dict(writer_profiles[profile])
+    if share <= 1:
+        return settings
+    if "ram_buffer_mb" in settings:
+        settings["ram_buffer_mb"] = max(settings["ram_buffer_mb"] // share, 64)
+    if "maxheap" in settings:
+        maxheap = settings["maxheap"].lower()
+        heapMB = int(maxheap[:-1]) * 1024 if maxheap.endswith("g") else int(maxheap.rstrip("m"))
+        # the buffer has to fit twice, while it is flushed
+        heapMB = max(heapMB // share, 2 * settings.get("ram_buffer_mb", 0), 512)
+        settings["maxheap"] = f"{heapMB}m"
+    return settings
+
+
+def createWriter(storeDir, openMode=None, profile: str = "default", share: int = 1):
+    """Open an IndexWriter on storeDir with the CustomAnalyzer
+
+    Args:
+        storeDir: Directory of the index store, created if missing
+        openMode: IndexWriterConfig.OpenMode of the writer, CREATE if None
+        profile: name of the writer_profiles entry configuring the writer
+        share: number of processes building with the profile at once, see profileSettings
+
+    Return:
+        IndexWriter
+    """
+    # java static fields only exist once the JVM is started, not at import
+    openMode = openMode or IndexWriterConfig.OpenMode.CREATE
+    settings = profileSettings(profile, share)
+    if not os.path.exists(storeDir):
+        os.mkdir(storeDir)
+
+    # Analyzer object - analyses based on basic grammar, remove stop words
+    analyzer = CustomAnalyzer()
+
+    # Index Writer Configuration object
+    config = IndexWriterConfig(analyzer)
+    config.setOpenMode(openMode)
+    if "ram_buffer_mb" in settings:
+        config.setRAMBufferSizeMB(float(settings["ram_buffer_mb"]))
+    if "compound" in settings:
+        config.setUseCompoundFile(settings["compound"])
+    if "segments_per_tier" in settings or "max_merged_segment_mb" in settings:
+        mergePolicy = TieredMergePolicy()
+        if "segments_per_tier" in settings:
+            mergePolicy.setSegmentsPerTier(float(settings["segments_per_tier"]))
+        if "max_merged_segment_mb" in settings:
+            mergePolicy.setMaxMergedSegmentMB(float(settings["max_merged_segment_mb"]))
+        if not settings.get("compound", True):
+            # merged segments would otherwise still be written as compound files
+            mergePolicy.setNoCFSRatio(0.0)
+        config.setMergePolicy(mergePolicy)
+
+    # create index store
+    store = FSDirectory.open(File(storeDir).toPath())
+
+    # create an inder writer
+    return IndexWriter(store, config)
+
+
+def mdateToMillis(mdate):
+    """Convert a dblp mdate attribute (YYYY-MM-DD) to epoch milliseconds, None if missing"""
+    if mdate is None:
+        return None
+    return int(datetime.strptime(mdate, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def toRecord(element):
+    """Copy a parsed dblp element into plain python objects
+
+    The record can be pickled and sent to a worker process, lxml elements cannot.
+
+    Args:
+        element: lxml element of a dblp record
+
+    Return:
+        (tag, attrib, fields): record type, its attributes and a list of
+        (tag, text) pairs for every known, non empty sub element
+    """
+    fields = []
+    for sub_element in element:
+        tag = sub_element.tag
+        if tag not in features:
+            continue
+        text = sub_element.text
+        if text is None:
+            text = ''.join(sub_element.itertext()).strip()
+        if text:
+            fields.append((tag, text))
+    return element.tag, dict(element.attrib), fields
+
+
+def normalize(text: str):
+    """Normalized form of venue and author names in doc values: lower case, single spaces"""
+    return " ".join(text.lower().split())
+
+
+def venueTerms(key: str, venues=()):
+    """Exact-match venue terms of a record, indexed untokenized in the "venues" field
+
+    Args:
+        key: dblp key, its second part names the venue, e.g. "aaai" for conf/aaai/AmirSS15
+        venues: booktitle and journal of the record
+
+    Returns:
+        list[str]: distinct normalized terms
+    """
+    terms = []
+    parts = key.split("/")
+    if len(parts) >= 3 and parts[0] in ("conf", "journals"):
+        terms.append(normalize(parts[1]))
+    for text in venues:
+        term = normalize(text)
+        if term and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def venueQueryTerm(conf: str):
+    """The "venues" term a user given venue matches, e.g. "aaai" for "AAAI" or "conf/aaai", None if empty"""
+    terms = venueTerms(conf + "/") if conf.startswith(("conf/", "journals/")) else venueTerms("", [conf])
+    return terms[0] if terms else None
+
+
+def _setInt(fields, text):
+    value = int(text)
+    point, docValues, stored = fields
+    point.setIntValue(value)
+    docValues.setLongValue(value)
+    stored.setIntValue(value)
+
+
+def _setString(fields, text):
+    fields[0].setStringValue(text)
+
+
+def _setAuthor(fields, text):
+    fields[0].setStringValue(text)
+    fields[1].setBytesValue(BytesRef(normalize(text)))
+
+
+class DocumentBuilder(object):
+    """Build lucene Documents from records returned by toRecord
+
+    Field types are created and frozen once, and the Document and Field
+    instances are reused from one record to the next, only their values
+    change. A built Document is only valid until the next call to build, so
+    it has to be handed to the IndexWriter right away. Needs a running JVM,
+    create one builder per process.
+    """
+
+    def __init__(self, keyphrases: bool = False):
+        """
+        Args:
+            keyphrases: extract the RAKE keyphrases of the title into the
+                exact-match, doc-valued "keyphrase" field
+        """
+        textType = FieldType()
+        textType.setStored(True)
+        textType.setTokenized(True)
+        textType.setStoreTermVectors(True)
+        textType.setStoreTermVectorPositions(True)
+        textType.setIndexOptions(IndexOptions.DOCS_AND_FREQS_AND_POSITIONS)
+        textType.freeze()
+
+        # kind of field -> (factory of the Field instances, setter of their value)
+        kinds = {
+            "int": (lambda tag: (IntPoint(tag, 0), SortedNumericDocValuesField(tag, 0), StoredField(tag, 0)), _setInt),
+            "string": (lambda tag: (Field(tag, "", StringField.TYPE_STORED),), _setString),
+            "stored": (lambda tag: (StoredField(tag, ""),), _setString),
+            "text": (lambda tag: (Field(tag, "", textType),), _setString),
+            # analytics read the normalized authors from doc values, never stored fields
+            "author": (lambda tag: (Field(tag, "", textType), SortedSetDocValuesField(tag, BytesRef())), _setAuthor),
+        }
+        self.schema = {}
+        for tag in features:
+            if tag == "year":
+                kind = "int"
+            elif tag == "author":
+                kind = "author"
+            elif tag in string_field:
+                kind = "string"
+            elif tag in store_field:
+                kind = "stored"
+            else:
+                kind = "text"
+            self.schema[tag] = kinds[kind]
+        # tag -> Field instances, one entry per value of multi-valued tags
+        self.pool = {tag: [] for tag in features}
+
+        self.doc = Document()
+        self.typeField = Field("type", "", StringField.TYPE_STORED)
+        # doc values columns for analytics, see Searher.readColumns
+        self.typeValues = SortedDocValuesField("type", BytesRef())
+        self.venueValues = SortedDocValuesField("venue", BytesRef())
+        # (StringField, SortedSetDocValuesField) per venue term, filtered on by
+        # Searher.confQuery and read as a column by the trend cube
+        self.venueFields = []
+        self.rake = createRake() if keyphrases else None
+        # (StringField, SortedSetDocValuesField) per keyphrase of the title
+        self.keyphraseFields = []
+        # exact-match key and mdate, used by incremental re-indexing
+        self.idField = StringField("id", "", Field.Store.NO)
+        self.idValues = SortedDocValuesField("id", BytesRef())
+        self.mdatePoint = LongPoint("mdate", 0)
+        self.mdateValues = NumericDocValuesField("mdate", 0)
+        self.mdateStored = StoredField("mdate", "")
+        self.keyField = Field("key", "", TextField.TYPE_STORED)
+        self.publtypeField = Field("publtype", "", TextField.TYPE_STORED)
+
+    def build(self, record):
+        """Fill the reused Document with a record returned by toRecord"""
+        tag, attrib, fields = record
+        doc = self.doc
+        doc.clear()
+
+        self.typeField.setStringValue(tag)
+        doc.add(self.typeField)
+        self.typeValues.setBytesValue(BytesRef(tag))
+        doc.add(self.typeValues)
+
+        key = attrib["key"]
+        self.idField.setStringValue(key)
+        doc.add(self.idField)
+        self.idValues.setBytesValue(BytesRef(key))
+        doc.add(self.idValues)
+        mdate = attrib.get("mdate")
+        if mdate is not None:
+            millis = mdateToMillis(mdate)
+            self.mdatePoint.setLongValue(millis)
+            doc.add(self.mdatePoint)
+            self.mdateValues.setLongValue(millis)
+            doc.add(self.mdateValues)
+            self.mdateStored.setStringValue(mdate)
+            doc.add(self.mdateStored)
+
+        self.keyField.setStringValue(key)
+        doc.add(self.keyField)
+        publtype = attrib.get("publtype")
+        if publtype is not None:
+            self.publtypeField.setStringValue(publtype)
+            doc.add(self.publtypeField)
+
+        used = {}
+        venues = []
+        title = None
+        for tag, text in fields:
+            if tag == "booktitle" or tag == "journal":
+                venues.append(text)
+            elif tag == "title" and title is None:
+                title = text
+            create, setValue = self.schema[tag]
+            index = used.get(tag, 0)
+            used[tag] = index + 1
+            pool = self.pool[tag]
+            if index == len(pool):
+                pool.append(create(tag))
+            setValue(pool[index], text)
+            for field in pool[index]:
+                doc.add(field)
+        if venues:
+            # single valued, a record with both booktitle and journal keeps the first
+            self.venueValues.setBytesValue(BytesRef(normalize(venues[0])))
+            doc.add(self.venueValues)
+        for index, term in enumerate(venueTerms(key, venues)):
+            if index == len(self.venueFields):
+                self.venueFields.append((StringField("venues", "", Field.Store.NO),
+                                         SortedSetDocValuesField("venues", BytesRef())))
+            field, docValues = self.venueFields[index]
+            field.setStringValue(term)
+            docValues.setBytesValue(BytesRef(term))
+            doc.add(field)
+            doc.add(docValues)
+        if self.rake is not None and title is not None:
+            # doc values keep each phrase once per doc
+            for index, phrase in enumerate(titleKeyphrases(title, self.rake)):
+                if index == len(self.keyphraseFields):
+                    self.keyphraseFields.append((StringField("keyphrase", "", Field.Store.NO),
+                                                 SortedSetDocValuesField("keyphrase", BytesRef())))
+                term, docValues = self.keyphraseFields[index]
+                term.setStringValue(phrase)
+                docValues.setBytesValue(BytesRef(phrase))
+                doc.add(term)
+                doc.add(docValues)
+        return doc
+
+
+def initVM(profile: str = "default", share: int = 1):
+    """Start the JVM with the heap required by the writer profile, see profileSettings"""
+    maxheap = profileSettings(profile, share).get("maxheap")
+    if maxheap:
+        lucene.initVM(maxheap=maxheap)
+    else:
+        lucene.initVM()
+
+
+def _indexWorker(storeDir, tasks, profile, keyphrases, share):
+    """Worker process: index record batches from tasks into its own sub-index
+
+    Runs until it receives None, then commits and closes its writer.
+    """
+    initVM(profile, share)
+    writer = createWriter(storeDir, profile=profile, share=share)
+    builder = DocumentBuilder(keyphrases)
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            break
+        for record in batch:
+            writer.addDocument(builder.build(record))
+    writer.commit()
+    writer.close()
+
+
+class IndexWorkerPool(object):
+    """Fan record batches out to worker processes, one sub-index per worker"""
+
+    def __init__(self, workers: int, partsDir: str, batchSize: int = 2000, profile: str = "default",
+                 keyphrases: bool = False):
+        """
+        Args:
+            workers: number of worker processes
+            partsDir: directory that receives the sub-indexes
+            batchSize: number of records sent to a worker at once
+            profile: writer profile of the workers, they split its RAM buffer and heap
+            keyphrases: index the keyphrases of the titles, see DocumentBuilder
+        """
+        # every worker starts its own JVM, forking a process with a live JVM is not safe
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue(maxsize=workers * 4)
+        self.dirs = [os.path.join(partsDir, f"part-{i}") for i in range(workers)]
+        self.processes = [context.Process(target=_indexWorker, args=(storeDir, self.tasks, profile, keyphrases, workers), daemon=True)
+                          for storeDir in self.dirs]
+        for process in self.processes:
+            process.start()
+        self.batchSize = batchSize
+        self.batch = []
+
+    def _put(self, item):
+        while True:
+            try:
+                self.tasks.put(item, timeout=1)
+                return
+            except queue.Full:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError("an indexing worker died, aborting the build")
+
+    def add(self, record):
+        self.batch.append(record)
+        if len(self.batch) >= self.batchSize:
+            self._put(self.batch)
+            self.batch = []
+
+    def join(self):
+        """Flush the pending batch, stop the workers and return the sub-index directories"""
+        if self.batch:
+            self._put(self.batch)
+            self.batch = []
+        for _ in self.processes:
+            self._put(None)
+        for process in self.processes:
+            process.join()
+        failed = [process.exitcode for process in self.processes if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"indexing workers exited with codes {failed}")
+        return self.dirs
+
+
+class DblpStream(object):
+    """Binary stream of a dblp dump, plain or gzip compressed
+
+    Compressed dumps are decompressed on the fly, nothing is written to disk.
+    Counts the bytes read from the underlying source to drive the progress bar.
+    """
+
+    def __init__(self, source):
+        """
+        Args:
+            source: path of dblp.xml or dblp.xml.gz, or a binary file object,
+                which is gzip decompressed when its name ends with .gz
+        """
+        if isinstance(source, str):
+            self.raw = open(source, "rb")
+            self.total = os.path.getsize(source)
+            self.owned = True
+            name = source
+        else:
+            self.raw = source
+            self.total = None
+            self.owned = False
+            name = getattr(source, "name", None)
+            if not isinstance(name, str):
+                name = "dblp.xml"
+        # dblp.dtd is resolved relative to the dump
+        self.base_url = os.path.abspath(name)
+        self.consumed = 0
+        if name.endswith(".gz"):
+            self.handle = gzip.GzipFile(fileobj=self, mode="rb")
+        else:
+            self.handle = self
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.consumed += len(data)
+        return data
+
+    def close(self):
+        if self.handle is not self:
+            self.handle.close()
+        if self.owned:
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class Indexer(object):
     
-    def __init__(self, root, storeDir):
+    def __init__(self, root, storeDir, workers: int = 1, incremental: bool = False,
+                 profile: str = "default", forceMerge: int = None,
+                 checkpoint: int = None, resume: bool = False, keyphrases: bool = False):
         """Initialize the class, and run indexDocs after initializing
         
         Args:
             root: Directory of the project
             storeDir: Directory of the index store
+            workers: number of indexing processes, 1 indexes on the current thread
+            incremental: update the existing index from the records whose mdate
+                changed instead of rebuilding it from scratch
+            profile: writer_profiles entry, "bulk" builds faster and "search"
+                also merges the index to one segment at the end
+            forceMerge: number of segments to merge down to in ending,
+                overrides the force_merge of the profile
+            checkpoint: commit the index every checkpoint records, with the
+                position in the dump stored in the commit user data
+            resume: append to the index of an interrupted build and continue
+                after its last checkpoint
+            keyphrases: extract the RAKE keyphrases of every title into the
+                "keyphrase" field, read by the trend analytics of main.py.
+                Stored in every commit, an index that is appended to keeps
+                the setting it was built with
 
         Return: None
 
         """
+        if workers > 1 and (checkpoint or resume):
+            raise ValueError("checkpoints cannot be combined with parallel indexing, "
+                             "the worker sub-indexes are only merged at the end")
+        self.storeDir = storeDir
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.complete = False
+        self.pool = None
+        self.profile = profile
+        self.keyphrases = keyphrases
+        if forceMerge is None:
+            forceMerge = writer_profiles[profile].get("force_merge")
+        self.forceMerge = forceMerge
+
+        initVM(profile)
+        # user data of the last commit, None if there is no index yet
+        commitData = self.loadCommitData()
+        # commit user data of the last checkpoint, None starts from the first record
+        self.resumeFrom = self.loadCheckpoint(commitData) if resume else None
+        appending = commitData is not None and (incremental or self.resumeFrom is not None)
+        if appending and commitData.get("keyphrases") is not None:
+            stored = commitData["keyphrases"] == "true"
+            if stored != keyphrases:
+                # mixing docs with and without keyphrases would undercount the trend analytics
+                print(f"Warning! the index was built with keyphrases={stored}, appending with the same setting")
+                self.keyphrases = stored
+        self.builder = DocumentBuilder(self.keyphrases)
+        if incremental:
+            self.writer = createWriter(storeDir, IndexWriterConfig.OpenMode.CREATE_OR_APPEND, profile)
+            self.versions = self.loadVersions()
+        else:
+            # without a checkpoint the records of the index are unknown, appending would add them twice
+            openMode = IndexWriterConfig.OpenMode.APPEND if self.resumeFrom is not None else IndexWriterConfig.OpenMode.CREATE
+            self.writer = createWriter(storeDir, openMode, profile)
+            # None: every record is added without looking at the existing index
+            self.versions = None
+        # the data of the appended commit is kept until it is replaced, with the keyphrases setting
+        self.setCommitData(commitData if appending else {})
+        self.stats = {"added": 0, "updated": 0, "skipped": 0, "deleted": 0}
+        self.metrics = IndexMetrics()
+        self.metrics.begin(self.writer)
+
+    def ending(self, metrics_path: str = None):
+        """Commit and close the index, then report the build metrics
 
-        if not os.path.exists(storeDir):
-            os.mkdir(storeDir)
-
-        lucene.initVM()
-        # Analyzer object - analyses based on basic grammar, remove stop words
-        analyzer = CustomAnalyzer()
-
-        # Index Writer Configuration object
-        config = IndexWriterConfig(analyzer)
-        config.setOpenMode(IndexWriterConfig.OpenMode.CREATE)
-
-        # create index store
-        store = FSDirectory.open(File(storeDir).toPath())
-
-        # create an inder writer
-        self.writer = IndexWriter(store,config)
+        Args:
+            metrics_path: JSON file receiving the metrics report, only printed if None
 
-    def ending(self):
+        Return:
+            dict: metrics report
+        """
+        if self.forceMerge:
+            print(f'merging the index down to {self.forceMerge} segments')
+            self.writer.forceMerge(self.forceMerge)
+        if self.complete:
+            self.setCommitData({"records": str(self.totalNumber), "complete": "true"})
         self.writer.commit()
+        self.metrics.finish(self.writer)
         self.writer.close()
+        report = self.metrics.report()
+        report["records"] = dict(self.stats)
+        report["profile"] = self.profile
+        if metrics_path:
+            with open(metrics_path, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+        print(json.dumps({name: report[name] for name in ("docs", "elapsed", "docs_per_sec", "timers")}))
         print('done')
+        return report
 
     
-    def getNumberOfArticle(self, dblp_path: str):
-        context = etree.iterparse(
-                dblp_path,
+    def iterRecords(self, stream, chunkSize: int = 1024 * 1024):
+        """Yield every top level dblp record of the stream, parsing it once
+
+        Args:
+            stream: DblpStream of the dump
+            chunkSize: number of decompressed bytes fed to the parser at once
+
+        Yields:
+            lxml element of each record, cleared after the caller is done
+        """
+        parser = etree.XMLPullParser(
+                events=("end",),
+                base_url=stream.base_url,
                 dtd_validation=False,
                 load_dtd=True,
                 no_network=False,
                 encoding="ISO-8859-1",
-                events = ("start","end"),
-                # events = ("end",),
             )
-        context = iter(context)
-        event, root = next(context)
 
-        total = 0
-        for event, element in context:
-            if element.tag in element_head and event == "end":
-                total = total + 1
-                element.clear()
+        while True:
+            data = stream.handle.read(chunkSize)
+            if not data:
+                break
+            parser.feed(data)
+            for event, element in parser.read_events():
+                if element.tag in element_head:
+                    yield element
+                    element.clear()
+        parser.close()
 
-        del context
-        return total
+
+    def loadVersions(self):
+        """Read the key -> mdate map of the documents already in the index
+
+        Return:
+            dict: dblp key -> mdate in epoch milliseconds (None if the record had none)
+        """
+        versions = {}
+        reader = DirectoryReader.open(self.writer)
+        try:
+            for context in reader.leaves():
+                leaf = context.reader()
+                ids = leaf.getSortedDocValues("id")
+                if ids is None:
+                    continue
+                mdates = leaf.getNumericDocValues("mdate")
+                live = leaf.getLiveDocs()
+                doc = ids.nextDoc()
+                while doc != DocIdSetIterator.NO_MORE_DOCS:
+                    if live is None or live.get(doc):
+                        key = ids.lookupOrd(ids.ordValue()).utf8ToString()
+                        if mdates is not None and mdates.advanceExact(doc):
+                            versions[key] = mdates.longValue()
+                        else:
+                            versions[key] = None
+                    doc = ids.nextDoc()
+            if reader.numDocs() > 0 and not versions:
+                raise RuntimeError("the index was built without the id field, "
+                                   "run a full rebuild before using incremental mode")
+        finally:
+            reader.close()
+        return versions
+
+
+    def indexRecord(self, record):
+        """Add, update or skip a record returned by toRecord
+
+        In incremental mode a record whose key and mdate are already indexed is
+        skipped and a changed record replaces the document with the same key.
+        """
+        key = record[1]["key"]
+        update = False
+        if self.versions is not None:
+            if key in self.versions:
+                previous = self.versions.pop(key)
+                if previous == mdateToMillis(record[1].get("mdate")):
+                    self.stats["skipped"] += 1
+                    return
+                update = True
+
+        timers = self.metrics.timers
+        if self.pool is not None:
+            start = time.perf_counter()
+            # the new version comes back through addIndexes, drop the old one now
+            if update:
+                self.writer.deleteDocuments(Term("id", key))
+            self.pool.add(record)
+            timers["add"] += time.perf_counter() - start
+        else:
+            start = time.perf_counter()
+            doc = self.builder.build(record)
+            built = time.perf_counter()
+            if update:
+                self.writer.updateDocument(Term("id", key), doc)
+            else:
+                self.writer.addDocument(doc)
+            timers["build"] += built - start
+            timers["add"] += time.perf_counter() - built
+        self.metrics.docs += 1
+        self.stats["updated" if update else "added"] += 1
+
+
+    def deleteMissing(self):
+        """Incremental mode: delete the indexed keys that are gone from the dump"""
+        for key in self.versions:
+            self.writer.deleteDocuments(Term("id", key))
+        self.stats["deleted"] += len(self.versions)
+        self.versions = {}
+
+
+    def setCommitData(self, data: dict):
+        """Attach data to the next commit of the writer, with the keyphrases setting of the index"""
+        commitData = HashMap()
+        for name, value in data.items():
+            commitData.put(name, value)
+        commitData.put("keyphrases", "true" if self.keyphrases else "false")
+        self.writer.setLiveCommitData(commitData.entrySet())
+
+
+    def commitCheckpoint(self, records: int, key: str, offset: int):
+        """Commit the index with the position of the last indexed record
+
+        Args:
+            records: number of records read from the dump so far
+            key: dblp key of the last record
+            offset: bytes read from the dump so far
+        """
+        self.setCommitData({"records": str(records), "key": key, "offset": str(offset)})
+        self.writer.commit()
+
+
+    def loadCommitData(self):
+        """Read the user data of the last commit of the index, before the writer is opened
+
+        Return:
+            dict: name -> value, None if there is no index
+        """
+        if not os.path.exists(self.storeDir):
+            return None
+        store = FSDirectory.open(File(self.storeDir).toPath())
+        try:
+            if not DirectoryReader.indexExists(store):
+                return None
+            userData = SegmentInfos.readLatestCommit(store).getUserData()
+            return {str(name): userData.get(name) for name in userData.keySet()}
+        finally:
+            store.close()
+
+
+    def loadCheckpoint(self, commitData: dict):
+        """The checkpoint stored in the last commit of the index
+
+        Args:
+            commitData: user data of the last commit, see loadCommitData
+
+        Return:
+            dict: records, key and offset of the last checkpoint, with complete
+            set to "true" if the build finished; None if there is no index or
+            its last commit has no checkpoint
+        """
+        if commitData is None:
+            print("Warning! there is no index to resume, building it from the first record")
+            return None
+        if commitData.get("records") is None:
+            print("Warning! the index has no checkpoint, rebuilding it from the first record")
+            return None
+        return {name: commitData.get(name) for name in ("records", "key", "offset", "complete")}
 
 
     def IndexSingle(self, element):
-        ft = FieldType()
-        ft.setStored(True)
-        ft.setTokenized(True)
-        ft.setStoreTermVectors(True)
-        ft.setStoreTermVectorPositions(True)
-        ft.setIndexOptions(IndexOptions.DOCS_AND_FREQS_AND_POSITIONS)
-
-        doc = Document()
-        doc.add(Field("type", element.tag, StringField.TYPE_STORED))
-
-        # doc.add(LongPoint('mdate', int(datetime.strptime(element.attrib["mdate"], '%Y-%m-%d').timestamp() * 1000)))
-        # doc.add(NumericDocValuesField('mdate', int(datetime.strptime(element.attrib["mdate"], '%Y-%m-%d').timestamp() * 1000)))
-        # doc.add(StoredField("mdate",  int(datetime.strptime(element.attrib["mdate"], '%Y-%m-%d').timestamp() * 1000)))
-
-        doc.add(Field("key", element.attrib["key"], TextField.TYPE_STORED))
-        # print(element.attrib["key"])
-        if (element.get('publtype') is not None):
-            doc.add(Field("publtype", element.attrib["publtype"], TextField.TYPE_STORED))
-        item_cleared= False
-        for sub_element in list(element):
-            tag = sub_element.tag
-            text = sub_element.text
-            if (text== None):
-                text = ''.join(t if t is not None else '' for t in sub_element.itertext()).strip()
-            if tag not in features:
-                continue
-            if text is not None and len(text) > 0:
-                if tag == "year":
-                    doc.add(IntPoint(tag, int(text)))
-                    doc.add(SortedNumericDocValuesField(tag, int(text)))
-                    doc.add(StoredField(tag,int(text)))
-                    # doc.add(Field(tag, int(text), SortedNumericDocValuesField.TYPE_STORED))
-                elif tag in string_field:
-                    doc.add(Field(tag, text, StringField.TYPE_STORED))
-                elif tag in store_field:
-                    doc.add(StoredField(tag, text))
-                    # doc.add(Field(tag, text, StoredField.TYPE_STORED))
-                elif tag == "title":
-                    doc.add(Field(tag, text, ft))
-                elif tag == "mdate" or tag == "isbn":
-                    doc.add(Field(tag,text, StringField.TYPE_NOT_STORED))
-                else:
-                    doc.add(Field(tag, text, ft))
-        self.writer.addDocument(doc)
-
-
-    def indexing(self, dblp_path: str, save_path):
-        if not os.path.exists(os.path.join(os.path.dirname(dblp_path), "dblp.dtd")):
-            print("Warning! dblp.dtd not found")
-        if not os.path.exists(dblp_path):
-            print("Warning! dblp.xml not found")
+        self.indexRecord(toRecord(element))
+
+
+    def mergeParts(self, dirs):
+        """Add the sub-indexes written by the workers to the main index"""
+        stores = [FSDirectory.open(File(storeDir).toPath()) for storeDir in dirs]
+        self.metrics.addedSegments += sum(SegmentInfos.readLatestCommit(store).size() for store in stores)
+        self.writer.addIndexes(stores)
+        for store in stores:
+            store.close()
+
+
+    def indexing(self, dblp_path, save_path, limit: int = None):
+        """Index the records of the dblp dump
+
+        Args:
+            dblp_path: path of dblp.xml or dblp.xml.gz, or a binary file object of either
+            save_path: unused
+            limit: stop after this many records, used by benchmarks
+        """
+        if isinstance(dblp_path, str) and not os.path.exists(dblp_path):
+            print(f"Warning! {dblp_path} not found")
+        if self.resumeFrom is not None and self.resumeFrom["complete"] == "true":
+            print("The index is complete, nothing to resume")
+            self.totalNumber = int(self.resumeFrom["records"])
+            return
 
         try:
-            self.totalNumber = self.getNumberOfArticle(dblp_path)
+            stream = DblpStream(dblp_path)
+            if not os.path.exists(os.path.join(os.path.dirname(stream.base_url), "dblp.dtd")):
+                print("Warning! dblp.dtd not found")
 
-            context = etree.iterparse(
-                dblp_path,
-                dtd_validation=False,
-                load_dtd=True,
-                no_network=False,
-                encoding="ISO-8859-1",
-                events = ("start","end"),
-                # events = ("end",),
-            )
-            
             number = 0
-
-            context = iter(context)
-            event, root = next(context)
-            # print(root.getprevious())
-
-            start_time = time.time()
-            previous_time = start_time
-            # total_iterations = 6907631
-            total_iterations = self.totalNumber
-            
-            times = []
-            time_per_cycle = []
             percent = 0
-            with tqdm(total=total_iterations) as pbar:
-                for event, element in context:
-                    if element.tag in element_head and event == "end":
-                        temp_element = element
-                        self.IndexSingle(temp_element)
+            timers = self.metrics.timers
+            skip = 0
+            if self.resumeFrom is not None:
+                # the parser needs the prolog and DTD and a gzip stream cannot
+                # seek, so the records before the checkpoint are parsed again
+                # but not indexed
+                skip = int(self.resumeFrom["records"])
+                print(f'resuming after record {skip} ({self.resumeFrom["key"]}, byte {self.resumeFrom["offset"]})')
+            if self.workers > 1:
+                partsDir = tempfile.mkdtemp(prefix="index-parts-",
+                                            dir=os.path.dirname(os.path.abspath(self.storeDir)))
+                self.pool = IndexWorkerPool(self.workers, partsDir, profile=self.profile, keyphrases=self.keyphrases)
+            # progress follows the bytes consumed by the parser, so the dump
+            # is read exactly once instead of being pre-counted
+            with stream, tqdm(total=stream.total, unit="B", unit_scale=True) as pbar:
+                start = time.perf_counter()
+                for element in self.iterRecords(stream):
+                    if number < skip:
                         number = number + 1
-                        pbar.update(1)
-                        if number >= total_iterations * percent / 100:
-                            current_time = time.time()
-                            elapsed_time = current_time-start_time
-
-                            cycle_time = current_time-previous_time
-                            time_per_cycle.append(cycle_time)
-                            previous_time = current_time
-                            
-                            times.append(elapsed_time)
-                            print(f'{percent}% done, elapsed time : {elapsed_time}s')
-                            print(f'{percent-10}% - {percent}%: {cycle_time}')
-                            percent += 10
-                        element.clear()
-            
-
-            with open('times.txt', 'w') as f:
-                for t in times:
-                    f.write(f'{t}\n')
-
-            with open('times_per_cycle.txt', 'w') as f:
-                for t in time_per_cycle:
-                    f.write(f'{t}\n')
+                        key = element.get("key")
+                        if self.versions is not None:
+                            self.versions.pop(key, None)
+                        if number == skip and key != self.resumeFrom["key"]:
+                            raise RuntimeError(f"record {skip} is {key} instead of {self.resumeFrom['key']}, "
+                                               "the dump changed since the checkpoint")
+                        pbar.update(stream.consumed - pbar.n)
+                        start = time.perf_counter()
+                        continue
+                    record = toRecord(element)
+                    timers["parse"] += time.perf_counter() - start
+                    self.indexRecord(record)
+                    number = number + 1
+                    if number % 1000 == 0:
+                        self.metrics.sample(self.writer)
+                    if self.checkpoint and number % self.checkpoint == 0:
+                        self.commitCheckpoint(number, record[1]["key"], stream.consumed)
+                    position = stream.consumed
+                    pbar.update(position - pbar.n)
+                    if stream.total and position >= stream.total * percent / 100:
+                        self.metrics.checkpoint(percent)
+                        percent += 10
+                    if limit is not None and number >= limit:
+                        break
+                    start = time.perf_counter()
+
+            if self.pool is not None:
+                print(f'merging {self.workers} sub-indexes')
+                self.mergeParts(self.pool.join())
+                shutil.rmtree(partsDir)
+                self.pool = None
+            if self.versions is not None and limit is None:
+                self.deleteMissing()
+            self.complete = limit is None
+            print(', '.join(f'{name}: {count}' for name, count in self.stats.items()))
+
+            self.totalNumber = number
 
         except IOError:
             print(
@@ -277,9 +939,62 @@ class Indexer(object):
             sys.exit()
 
 
+def benchmark(records: int, dblp_path: str = None, metrics_path: str = None, **options):
+    """Index the first records of a dump into a throwaway index and report the metrics
+
+    Args:
+        records: number of records to index
+        dblp_path: dump to read, a synthetic sample of records is generated if None
+        metrics_path: JSON file receiving the metrics report
+        options: extra Indexer arguments, e.g. workers
+
+    Return:
+        dict: metrics report of the run
+    """
+    from utils.sample import writeSyntheticDblp
+
+    workDir = tempfile.mkdtemp(prefix="index-bench-")
+    try:
+        if dblp_path is None:
+            dblp_path = writeSyntheticDblp(os.path.join(workDir, "sample.xml"), records)
+        indexer = Indexer(root="./", storeDir=os.path.join(workDir, "index"), **options)
+        indexer.indexing(dblp_path, None, limit=records)
+        report = indexer.ending()
+        report["benchmark"] = {"records": records, "source": str(dblp_path), "options": options}
+        if metrics_path:
+            with open(metrics_path, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+        return report
+    finally:
+        shutil.rmtree(workDir)
+
+
 if __name__ == "__main__":
-    indexer = Indexer(root="./", storeDir="./index/")
-    dblp.download_dataset()
-    indexer.indexing("dblp.xml", "dblp.json")
-    indexer.ending()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the dblp index")
+    parser.add_argument("--workers", type=int, default=1, help="Number of indexing processes (e.g., 32)")
+    parser.add_argument("--incremental", action="store_true", help="Only index the records whose mdate changed since the last build")
+    parser.add_argument("--profile", choices=sorted(writer_profiles), default="default", help="IndexWriter settings: 'bulk' builds faster, 'search' also merges to one segment")
+    parser.add_argument("--force-merge", type=int, help="Merge the index down to N segments at the end of the build")
+    parser.add_argument("--checkpoint", type=int, help="Commit the index every N records so an interrupted build can be resumed")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted build from its last checkpoint")
+    parser.add_argument("--dblp", default="dblp.xml.gz", help="dblp dump to index, plain or gzip compressed")
+    parser.add_argument("--metrics", help="Write the build metrics as JSON to this file (e.g., 'metrics.json')")
+    parser.add_argument("--benchmark", type=int, help="Index only the first N records into a temporary index and report the metrics")
+    parser.add_argument("--keyphrases", action="store_true", help="Extract the RAKE keyphrases of the titles at index time, for main.py")
+    parser.add_argument("--sample", action="store_true", help="With --benchmark, index a generated sample instead of dblp.xml")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, None if args.sample else args.dblp, args.metrics,
+                  workers=args.workers, profile=args.profile, forceMerge=args.force_merge,
+                  keyphrases=args.keyphrases)
+    else:
+        indexer = Indexer(root="./", storeDir="./index/", workers=args.workers, incremental=args.incremental,
+                          profile=args.profile, forceMerge=args.force_merge,
+                          checkpoint=args.checkpoint, resume=args.resume, keyphrases=args.keyphrases)
+        dblp.download_dataset()
+        indexer.indexing(args.dblp, "dblp.json")
+        indexer.ending(args.metrics)
 
@@ -24,25 +24,47 @@ Usage
 
 >>> getHotspotsEvo("AAAI", "Computer Vision", 2010)
 <return a list of #papers related to "Computer Vision" published in "AAAI" since 2010>
+
+>>> buildCube()
+<precompute the venue x year keyphrase and author counts after indexing>
+
+>>> getTopAuthors("AAAI", 2010)
+<return a list of authors ranked by #papers published in "AAAI" since 2010>
 """
 
-import lucene
-from query import *
-from rake_nltk import Rake
-import matplotlib.pyplot as plt
-from thefuzz import fuzz
+import time
+from collections import Counter, defaultdict
+# lucene, the index and matplotlib are imported on first use: the keyphrase
+# worker processes import this module again and must not start a JVM
+from utils.keyphrases import createRake, countKeyphrases, rankKeyphrases
+from utils.cube import TrendCube, writeCube
+import numpy as np
+from rapidfuzz import process, fuzz as rfuzz
+from thefuzz import utils as fuzz_utils
 
 
 storeDir = "./index/"
 topK = 20
-searcher = Searher(store_dir = storeDir, topK = topK)
+_searcher = None
+
+cubeDir = "./cube/"
+# (index version, TrendCube or None) of the last lookup
+_cube = None
 
 FUZZY_THRESH = 80
-    
-stop_words = ['abstract', 'approach', 'commitee', 'report', 'study', 'paper']
+
+
+def getSearcher():
+    """Searher of storeDir, opened by the first call"""
+    global _searcher
+    if _searcher is None:
+        from query import Searher
+        _searcher = Searher(store_dir = storeDir, topK = topK)
+    return _searcher
 
 
 def describe(data: dict, title=None, xlabel=None, ylabel=None):
+    import matplotlib.pyplot as plt
     plt.rcParams.update({'axes.labelsize': 'large'})
     years = list(data.keys())
     plt.figure(figsize=(10, 8), dpi=100)
@@ -77,37 +99,77 @@ def describe(data: dict, title=None, xlabel=None, ylabel=None):
     plt.show()
 
 
-def getPivotAuthors(keyword: str, start: int, end=2023, conf=None):
+def getPivotAuthors(keyword: str, start: int, end=2023, conf=None, narrow=False):
+    """Authors ranked by the number of their papers with a keyphrase fuzzy matching keyword
+
+    Args:
+        keyword: research field, e.g. "Computer Vision"
+        start, end, conf: year range and venue of the papers
+        narrow: only look at titles sharing an analyzed term with keyword,
+            instead of every paper of the venue and years. Faster, but an
+            approximation: fuzzy matches spelled differently, e.g. "realtime"
+            for "real time" or "data sets" for "datasets", are missed
+
+    Returns:
+        list[(author, count)]: an author counts once per matching keyphrase of each paper
+    """
+    from org.apache.lucene.search import BooleanQuery, BooleanClause
+    searcher = getSearcher()
     # 1. Get keyword of this doc
-    docs = searcher.multiFieldSearch(start, end, conf, printing=False, top_k=1000000)
-    rake = Rake(min_length=2, max_length=4)
-    authors = {}
+    query = searcher.multiFieldQuery(start, end, conf)
+    if narrow:
+        query = BooleanQuery.Builder() \
+            .add(query, BooleanClause.Occur.FILTER) \
+            .add(searcher.anyTermQuery("title", keyword), BooleanClause.Occur.FILTER) \
+            .build()
+    docs = searcher.printResult(query, return_all=True, save_to_local=False, file_name="pivot.json", topK=None,
+                                fields=["title", "author"])
+    rake = createRake()
+    # distinct keyphrase -> row of the score matrix
+    vocabulary = {}
+    papers = []
     for doc in docs:
+        if 'title' not in doc or 'author' not in doc:
+            continue
         rake.extract_keywords_from_text(doc['title'])
         keywords = rake.get_ranked_phrases()
         for k in keywords:
-            if fuzz.token_set_ratio(k, keyword) < FUZZY_THRESH:
-                continue
-            # 2. If match given keyword, fields['author']++
-            if 'author' not in doc:
-                continue
-            for author in doc['author']:
-                if author in authors:
-                    authors[author] += 1
-                else:
-                    authors[author] = 1
-            continue
+            vocabulary.setdefault(k, len(vocabulary))
+        papers.append((keywords, doc['author']))
+    if not vocabulary:
+        return []
+
+    # 2. Score every distinct keyphrase at once, rounded like thefuzz.fuzz.token_set_ratio
+    scores = process.cdist(list(vocabulary), [keyword], scorer=rfuzz.token_set_ratio,
+                           processor=_fuzzProcess, workers=-1)
+    matched = np.round(scores[:, 0]) >= FUZZY_THRESH
+
+    # 3. If match given keyword, fields['author']++
+    authors = Counter()
+    for keywords, paperAuthors in papers:
+        matches = sum(1 for k in keywords if matched[vocabulary[k]])
+        if matches:
+            for author in paperAuthors:
+                authors[author] += matches
     return sorted(authors.items(), key=lambda x: x[1], reverse=True)
+
+
+def _fuzzProcess(text: str):
+    """Preprocessing thefuzz applies before scoring"""
+    return fuzz_utils.full_process(text, force_ascii=True)
     
 
-def getConfHotspotsEvo(conf: str, start: int, end=2023, top_k=5):
-    keywords_glob = _getConfHotspots(conf, start, end)[:top_k]
+def getConfHotspotsEvo(conf: str, start: int, end=2023, top_k=5, jobs=1):
+    yearly = _getConfHotspotsByYear(conf, start, end, jobs)
+    total = Counter()
+    for year in range(start, end + 1):
+        total.update(dict(yearly[year]))
+    keywords_glob = rankKeyphrases(total)[:top_k]
     res = {}
     print('*'*10, 'Yearly Conference Hostspots Summary', '*'*10)
     print('Research hotspots since', start, 'to', end, 'are', keywords_glob)
     for i in range(start, end + 1):
-        keywords = _getConfHotspots(conf, i, i)
-        res[i] = _intersect(keywords, keywords_glob)
+        res[i] = _intersect(yearly[i], keywords_glob)
         print(str(i) + ':', res[i])
     return res
 
@@ -117,38 +179,122 @@ def _intersect(src: list, filter: list):
     return [i for i in src if i[0] in key]
 
 
-def getConfHotspots(conf: str,  start: int, end=2023, top_k=5):
+def getConfHotspots(conf: str,  start: int, end=2023, top_k=5, jobs=1):
+    yearly = _getConfHotspotsByYear(conf, start, end, jobs)
     keywordsMap = {}
     print('*'*10, 'Keywords Summary', '*'*10)
     for i in range(start, end + 1):
-        keywords = _getConfHotspots(conf, i, i)
-        keywordsMap[i] = keywords[:top_k]
+        keywordsMap[i] = yearly[i][:top_k]
         print(i, ":", keywordsMap[i])
     return keywordsMap
      
 
-def _getConfHotspots(conf: str, start: int, end=2023):
-    res = searcher.multiFieldSearch(start, end, conf, return_all=True, printing=False)
-    
-    titles = [doc['title'] for doc in res]
-    
-    # print('*'*5, 'Index Done, Start Keyword Extraction', '*'*5)
-    rake = Rake(min_length=2, max_length=4)
-    rake.extract_keywords_from_sentences(titles)
-    keywords = rake.get_ranked_phrases()
-    
-    cnt = {}
-    for word in keywords:
-        if any(ele in word for ele in stop_words):
+def _getConfHotspotsByYear(conf: str, start: int, end=2023, jobs=1):
+    """Keyphrase counts of conf for every year in [start, end]
+
+    Runs a single venue and year range query, the hits are bucketed by the
+    year doc values instead of searching each year again.
+
+    Args:
+        jobs: processes extracting the keyphrases of all years, when the
+            index has no "keyphrase" field
+
+    Returns:
+        dict: year -> [(keyphrase, count)] sorted by decreasing count, then keyphrase
+    """
+    from indexing import venueQueryTerm
+    searcher = getSearcher()
+    cube = _openCube()
+    venue = venueQueryTerm(conf) if conf else None
+    if cube is not None and venue is not None and start:
+        return {year: cube.top("keyphrase", venue, year, year) for year in range(start, end + 1)}
+
+    query = searcher.multiFieldQuery(start, end, conf)
+    if searcher.hasField("keyphrase"):
+        # extracted at index time, aggregated from the doc values
+        columns = searcher.readColumns(query, columns=("year", "keyphrase"))
+        counts = {year: Counter() for year in range(start, end + 1)}
+        for year, phrases in zip(columns["year"], columns["keyphrase"]):
+            if year in counts:
+                counts[year].update(phrases)
+        return {year: rankKeyphrases(cnt) for year, cnt in counts.items()}
+
+    groups = searcher.groupByColumn(query, "year", ["title"])
+    titles = {year: [doc['title'] for doc in groups.get(year, []) if 'title' in doc] for year in range(start, end + 1)}
+    return {year: rankKeyphrases(cnt) for year, cnt in countKeyphrases(titles, jobs).items()}
+
+
+def getTopAuthors(conf: str, start: int, end=2023, top_k=10):
+    """Authors ranked by their number of papers in conf within [start, end], names are normalized"""
+    from indexing import venueQueryTerm
+    searcher = getSearcher()
+    cube = _openCube()
+    venue = venueQueryTerm(conf) if conf else None
+    if cube is not None and venue is not None and start:
+        authors = cube.top("author", venue, start, end, top_k)
+    else:
+        columns = searcher.readColumns(searcher.multiFieldQuery(start, end, conf), columns=("author",))
+        authors = Counter()
+        for names in columns["author"]:
+            authors.update(names)
+        authors = rankKeyphrases(authors)[:top_k]
+    print('*'*10, 'Top Authors', '*'*10)
+    for author, count in authors:
+        print(author + ':', count)
+    return authors
+
+
+def buildCube(path=cubeDir, jobs=1):
+    """Precompute the counts per (venue, year, keyphrase) and (venue, year, author)
+
+    The trend functions answer from the cube while the index is the one it
+    was built from, run it again after every indexing. Keyphrases come from
+    the "keyphrase" field if the index has it, else from RAKE over the titles
+    with jobs processes, like the live queries.
+    """
+    from indexing import venueTerms
+    from org.apache.lucene.search import MatchAllDocsQuery
+    global _cube
+    searcher = getSearcher()
+    start_time = time.time()
+    generation = searcher.generation()
+    fromIndex = searcher.hasField("keyphrase")
+    # the venue terms of each doc, or the booktitle and journal to derive them from in older indexes
+    venueColumn = searcher.hasDocValues("venues")
+    columns = ("id", "venues" if venueColumn else "venue", "year", "author") + (("keyphrase",) if fromIndex else ())
+    storedFields = (() if fromIndex else ("title",)) + (() if venueColumn else ("booktitle", "journal"))
+
+    keyphrases = defaultdict(Counter)
+    titles = defaultdict(list)
+    authors = defaultdict(Counter)
+    for docId, values in searcher.iterColumns(MatchAllDocsQuery(), columns=columns, storedFields=storedFields):
+        key, venues, year, names = values[:4]
+        if key is None or year is None:
             continue
-        if word in cnt:
-            cnt[word] += 1
-        else:
-            cnt[word] = 1
-            
-    cnt = sorted(cnt.items(), key=lambda item: item[1], reverse=True)
-    
-    return cnt
+        if not venueColumn:
+            venues = venueTerms(key, [venue for venue in values[-2:] if venue is not None])
+        # every venue term the doc can be searched by, see Searher.confQuery
+        for term in venues:
+            authors[(term, year)].update(names)
+            if fromIndex:
+                keyphrases[(term, year)].update(values[4])
+            elif values[4] is not None:
+                titles[(term, year)].append(values[4])
+    if not fromIndex:
+        keyphrases = countKeyphrases(dict(titles), jobs)
+
+    writeCube(path, generation, {"keyphrase": keyphrases, "author": authors}, "index" if fromIndex else "rake")
+    _cube = None
+    print(f"Trend cube of {len(authors)} venue-years written to {path} in {time.time() - start_time:.1f} seconds")
+
+
+def _openCube():
+    """TrendCube of the current index version, None if it has to be built first"""
+    global _cube
+    generation = getSearcher().generation()
+    if _cube is None or _cube[0] != generation:
+        _cube = (generation, TrendCube.load(cubeDir, generation))
+    return _cube[1]
 
 
 if __name__ == "__main__":
@@ -157,13 +303,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="visdoc: Research Trend Explorer App")
     
     # Define hints for the functions
-    parser.add_argument("function", choices=["getConfHotspots", "getPivotAuthors", "getHotspotsEvo"], help="Select a function (e.g., 'getConfHotspots')")
+    parser.add_argument("function", choices=["getConfHotspots", "getPivotAuthors", "getHotspotsEvo", "getTopAuthors", "buildCube"], help="Select a function (e.g., 'getConfHotspots')")
     
     # Define hints for the arguments
     parser.add_argument("--conference", help="Specify the conference name (e.g., 'AAAI')")
     parser.add_argument("--start", type=int, help="Specify the start year (e.g., 2018)")
     parser.add_argument("--end", type=int, help="Specify the end year (e.g., 2023)")
     parser.add_argument("--research_field", help="Specify the research field (e.g., 'LLM')")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes extracting keyphrases (e.g., 8)")
     
     args = parser.parse_args()
     
@@ -171,11 +318,15 @@ if __name__ == "__main__":
         args.end = 2023
 
     if args.function == "getConfHotspots":
-        getConfHotspots(args.conference, args.start)
+        getConfHotspots(args.conference, args.start, args.end, jobs=args.jobs)
     elif args.function == "getPivotAuthors":
-        getPivotAuthors(args.research_field, args.start, args.end. args.conference)
+        getPivotAuthors(args.research_field, args.start, args.end, args.conference)
     elif args.function == "getHotspotsEvo":
-        getHotspotsEvo(args.conference, args.start, args.end)
+        getConfHotspotsEvo(args.conference, args.start, args.end, jobs=args.jobs)
+    elif args.function == "getTopAuthors":
+        getTopAuthors(args.conference, args.start, args.end)
+    elif args.function == "buildCube":
+        buildCube(jobs=args.jobs)
 
 
     
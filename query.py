@@ -6,16 +6,18 @@ import lucene
 
 from java.nio.file import Paths
 from org.apache.lucene.index import Term
-from org.apache.lucene.search import BooleanClause, TermQuery, BooleanQuery, PhraseQuery
+from org.apache.lucene.search import BooleanClause, TermQuery, BooleanQuery, PhraseQuery, ConstantScoreQuery, MatchNoDocsQuery
 from org.apache.lucene.store import FSDirectory
-from indexing import CustomAnalyzer
-from org.apache.lucene.index import DirectoryReader
-from org.apache.lucene.queryparser.classic import QueryParser
-from org.apache.lucene.search import IndexSearcher
+from indexing import CustomAnalyzer, venueQueryTerm
+from org.apache.lucene.index import DirectoryReader, FieldInfos, DocValuesType
+from org.apache.lucene.queryparser.classic import QueryParser, ParseException
+from org.apache.lucene.search import IndexSearcher, ScoreMode, DocIdSetIterator, Sort, SearcherManager
 from org.apache.lucene.document import IntPoint
 from org.apache.lucene.analysis.standard import StandardAnalyzer
 from org.apache.lucene.queryparser.flexible.standard import StandardQueryParser
 from org.apache.lucene.analysis.tokenattributes import CharTermAttribute
+from org.apache.lucene.document import DocumentStoredFieldVisitor
+from java.util import HashSet
 
 import re
 
@@ -23,17 +25,150 @@ import re
 import time
 
 import json
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cache import LRUCache
+from utils.metrics import LatencyStats
+from utils.sinks import ConsoleSink, JsonLinesSink
 
 lucene.initVM()
 
+logger = logging.getLogger(__name__)
+
+# doc values columns written by DocumentBuilder in indexing.py, column -> doc values type
+doc_value_columns = {
+    "id": "sorted",
+    "type": "sorted",
+    "venue": "sorted",
+    # every term of the "venues" field, see indexing.venueTerms
+    "venues": "sorted_set",
+    "author": "sorted_set",
+    "year": "sorted_numeric",
+    "mdate": "numeric",
+    # only in indexes built with --keyphrases
+    "keyphrase": "sorted_set",
+}
+
+# search spec method -> (Searher method, search parameters), see Searher.runSearch
+search_methods = {
+    "year": ("searchByYearRange", {"start": int, "end": int}),
+    "conf": ("searchByConf", {"conf": str}),
+    "keyword": ("searchByKeyword", {"key": str}),
+    "author": ("searchByAuthor", {"author": str}),
+    "multi": ("multiFieldSearch", {"start": int, "end": int, "conf": str, "key": str, "author": str}),
+}
+
+# result options a search spec may set, printing and exporting are left to the caller
+search_options = {
+    "top_k": int,
+    "return_all": lambda value: value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes"),
+    "fields": lambda value: value.split(",") if isinstance(value, str) else list(value),
+}
+
+
+def attachThread():
+    """Make the calling thread usable by lucene, every thread calling into the JVM needs it"""
+    lucene.getVMEnv().attachCurrentThread()
+
+
+def _columnReader(leaf, column):
+    """Return a function doc -> value of a doc values column of a leaf reader, in increasing doc order"""
+    kind = doc_value_columns[column]
+    if kind == "sorted":
+        values = leaf.getSortedDocValues(column)
+        if values is None:
+            return lambda doc: None
+        terms = {}
+
+        def read(doc):
+            if not values.advanceExact(doc):
+                return None
+            ord = values.ordValue()
+            if ord not in terms:
+                terms[ord] = values.lookupOrd(ord).utf8ToString()
+            return terms[ord]
+    elif kind == "sorted_set":
+        values = leaf.getSortedSetDocValues(column)
+        if values is None:
+            return lambda doc: []
+        terms = {}
+
+        def read(doc):
+            if not values.advanceExact(doc):
+                return []
+            result = []
+            for _ in range(values.docValueCount()):
+                ord = values.nextOrd()
+                if ord not in terms:
+                    terms[ord] = values.lookupOrd(ord).utf8ToString()
+                result.append(terms[ord])
+            return result
+    elif kind == "sorted_numeric":
+        values = leaf.getSortedNumericDocValues(column)
+        if values is None:
+            return lambda doc: None
+
+        def read(doc):
+            if not values.advanceExact(doc):
+                return None
+            return values.nextValue()
+    else:
+        values = leaf.getNumericDocValues(column)
+        if values is None:
+            return lambda doc: None
+
+        def read(doc):
+            if not values.advanceExact(doc):
+                return None
+            return values.longValue()
+    return read
+
+
+def _normalize(value):
+    """Normalize a search parameter for the result cache key: strip and collapse spaces"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def _estimateSize(hits):
+    """Rough size in bytes of converted hits, used to bound the result cache"""
+    size = 64
+    for docId, score, result in hits:
+        size += 128
+        values = result.values() if isinstance(result, dict) else result
+        for value in values:
+            if isinstance(value, list):
+                size += sum(56 + len(item) for item in value)
+            elif isinstance(value, str):
+                size += 56 + len(value)
+            else:
+                size += 16
+    return size
+
+
+def _copyResult(result):
+    """Copy of a cached result and of its lists, so that callers cannot change the cache"""
+    if isinstance(result, dict):
+        return {name: list(value) if isinstance(value, list) else value for name, value in result.items()}
+    return result._replace(**{name: list(value) for name, value in result._asdict().items() if isinstance(value, list)})
+
+
 class CustomQueryParser:
+    # boolean operators between the clauses of a query
+    operators = re.compile('( AND | OR | NOT |, )')
+
     def __init__(self, field, analyzer):
         self.field = field
         self.analyzer = analyzer
 
     def parse(self, string):
         string = string.upper()  # Convert to upper case
-        tokens = re.split('( AND | OR | NOT |, )', string)  # Split the string into tokens
+        tokens = self.operators.split(string)  # Split the string into tokens
 
         # Initialize a BooleanQuery.Builder
         query_builder = BooleanQuery.Builder()
@@ -61,6 +196,8 @@ class CustomQueryParser:
                 stream.end()
                 stream.close()
 
+                if not words:
+                    raise ValueError(f"nothing to search in {token.strip()!r}, it is empty or only stop words")
                 if len(words) > 1:
                     # If the token contains more than one word, create a PhraseQuery
                     phrase_query = PhraseQuery.Builder()
@@ -75,7 +212,20 @@ class CustomQueryParser:
 
 
 class Searher(object):
-    def __init__(self, store_dir: str, topK: int):
+    def __init__(self, store_dir: str, topK: int, cacheEntries: int = 1024, cacheBytes: int = 256 * 1024 * 1024,
+                 refreshInterval: float = 0, searchThreads: int = 0, queryCacheEntries: int = 4096):
+        """
+        Args:
+            store_dir (str): directory of the index
+            topK (int): default number of results
+            cacheEntries (int): size of the LRU result cache, 0 disables it
+            cacheBytes (int): estimated memory bound of the result cache
+            refreshInterval (float): seconds between background checks for a
+                new commit of the index, 0 to only refresh on demand
+            searchThreads (int): java threads searching the segments of one
+                query in parallel, 0 to search them on the calling thread
+            queryCacheEntries (int): size of the LRU cache of parsed queries, 0 disables it
+        """
         # Analyzer
         self.analyzer = CustomAnalyzer()
         self.topK = topK
@@ -83,98 +233,672 @@ class Searher(object):
         # Create directory instance
         store = FSDirectory.open(Paths.get(store_dir))
 
-        # Create DirectoryReader instance
-        reader = DirectoryReader.open(store)
+        # Reopens the DirectoryReader when the index is committed again, the
+        # IndexSearcher of each version lives until its last query releases it
+        self.manager = SearcherManager(store, None)
+
+        self.executor = None
+        self._parallel = None
+        self._parallelLock = threading.Lock()
+        if searchThreads:
+            from java.util.concurrent import Executors
+            self.executor = Executors.newFixedThreadPool(searchThreads)
+
+        # QueryParser is not thread-safe, each thread keeps its own per field
+        self._local = threading.local()
+        self.titleParser = CustomQueryParser('title', self.analyzer)
 
-        # Create IndexSearcher
-        self.searcher = IndexSearcher(reader)
+        # Parsed queries by (field, normalized input), they do not depend on
+        # the index and are immutable, so they are shared by every thread
+        self.queryCache = LRUCache(queryCacheEntries) if queryCacheEntries else None
+
+        # called with (name, number of results, seconds) after every search
+        self.timingHook = None
+
+        # Results of repeated searches, dropped when the index version changes
+        self.cache = LRUCache(cacheEntries, cacheBytes) if cacheEntries else None
 
         # Number of Docs
-        self.NumOfDocs = self.searcher.getIndexReader().numDocs()
-    
+        with self.acquire() as searcher:
+            self.NumOfDocs = searcher.getIndexReader().numDocs()
+
+        self._stopRefresh = threading.Event()
+        self._refreshThread = None
+        if refreshInterval:
+            self.startAutoRefresh(refreshInterval)
+
+
+    @contextmanager
+    def acquire(self):
+        """Borrow the current IndexSearcher, its reader stays open until the block exits
+
+        All doc ids of one query must come from the same acquired searcher, a
+        refresh may renumber them.
+        """
+        searcher = self.manager.acquire()
+        try:
+            yield searcher if self.executor is None else self._parallelSearcher(searcher)
+        finally:
+            self.manager.release(searcher)
+
+
+    def _parallelSearcher(self, searcher):
+        """IndexSearcher sharing the reader of searcher and searching its segments on the executor"""
+        reader = searcher.getIndexReader()
+        with self._parallelLock:
+            if self._parallel is None or not self._parallel.getIndexReader().equals(reader):
+                # one per reader version, shared by every thread
+                self._parallel = IndexSearcher(reader, self.executor)
+            return self._parallel
+
 
-    def printResult(self, query, return_all:bool, save_to_local:bool, file_name:str, topK:int, printing:bool=True):
-        """ Convert scoreDocs to a list of dict
-            scoreDocs: result
+    def refresh(self):
+        """Open the latest commit of the index if it changed, without blocking queries
+
+        Queries already running keep the searcher they acquired, the old reader
+        is closed once they have all released it.
 
         Returns:
-            list[map]: all docs within given year range [start, end)
+            bool: whether a new version of the index is now searched
         """
-        if return_all:
-            number = self.NumOfDocs
-        else:
-            number = topK
-        
-        start_time = time.time()
-        scoreDocs = self.searcher.search(query, number).scoreDocs
-        print('*'*5, number, 'documents found, converting', '*'*5)
-
-        reading_list = []
-        for index, scoreDoc in enumerate(scoreDocs):
-            doc = self.searcher.doc(scoreDoc.doc)
-            temp_dict = {}
-            for field in doc.getFields():
-                if field.name() == "author":    
-                    if temp_dict.get(field.name()) == None:
-                        temp_dict[field.name()] = list()
-                    temp_dict[field.name()] = temp_dict.get(field.name()) + [field.stringValue()]
+        if self.manager.isSearcherCurrent():
+            return False
+        self.manager.maybeRefreshBlocking()
+        with self.acquire() as searcher:
+            self.NumOfDocs = searcher.getIndexReader().numDocs()
+        return True
+
+
+    def startAutoRefresh(self, interval: float):
+        """Call refresh every interval seconds from a daemon thread"""
+        if self._refreshThread is not None:
+            return
+        self._stopRefresh.clear()
+
+        def run():
+            lucene.getVMEnv().attachCurrentThread()
+            while not self._stopRefresh.wait(interval):
+                if self.refresh():
+                    logger.info("Index refreshed, %d documents", self.NumOfDocs)
+
+        self._refreshThread = threading.Thread(target=run, name="searcher-refresh", daemon=True)
+        self._refreshThread.start()
+
+
+    def close(self):
+        """Stop the background refresh and close the readers once they are released"""
+        if self._refreshThread is not None:
+            self._stopRefresh.set()
+            self._refreshThread.join()
+            self._refreshThread = None
+        self.manager.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+    def iterMatches(self, query, searcher=None):
+        """Walk the live documents matching query without scoring or loading them
+
+        Args:
+            searcher: IndexSearcher acquired by the caller, the current one if None
+
+        Yields:
+            (leaf, docBase, docs): leaf reader, its first global doc id, and the
+            sorted leaf-local ids of the matching documents of that leaf
+        """
+        if searcher is None:
+            with self.acquire() as searcher:
+                yield from self.iterMatches(query, searcher)
+            return
+        weight = searcher.createWeight(searcher.rewrite(query), ScoreMode.COMPLETE_NO_SCORES, 1.0)
+        for context in searcher.getIndexReader().leaves():
+            scorer = weight.scorer(context)
+            if scorer is None:
+                continue
+            leaf = context.reader()
+            live = leaf.getLiveDocs()
+            iterator = scorer.iterator()
+            docs = []
+            doc = iterator.nextDoc()
+            while doc != DocIdSetIterator.NO_MORE_DOCS:
+                if live is None or live.get(doc):
+                    docs.append(doc)
+                doc = iterator.nextDoc()
+            if docs:
+                yield leaf, context.docBase, docs
+
+
+    def readColumns(self, query=None, docIds=None, columns=("venue", "year", "type", "author")):
+        """Read doc values columns of a set of documents, stored fields are never loaded
+
+        Args:
+            query: lucene Query selecting the documents
+            docIds: global doc ids selecting the documents, used if query is None
+            columns: names from doc_value_columns
+
+        Returns:
+            dict: "docid" -> sorted list of doc ids, and each column -> list of
+            values aligned with it (a list of names per doc for "author")
+        """
+        result = {"docid": []}
+        for column in columns:
+            result[column] = []
+
+        for docId, values in self.iterColumns(query, docIds, columns):
+            result["docid"].append(docId)
+            for column, value in zip(columns, values):
+                result[column].append(value)
+        return result
+
+
+    def iterColumns(self, query=None, docIds=None, columns=("venue", "year", "type", "author"), storedFields=()):
+        """Stream the columns of a set of documents one doc at a time, see readColumns
+
+        Args:
+            storedFields: names of stored fields also loaded for each doc, slower
+                than doc values
+
+        Yields:
+            (docId, values): values of columns then of storedFields, a stored
+            field is None if missing and a list of names for "author"
+        """
+        storedFields = tuple(storedFields)
+        if storedFields:
+            fieldsToLoad = HashSet()
+            for name in storedFields:
+                fieldsToLoad.add(name)
+
+        with self.acquire() as searcher:
+            if query is not None:
+                matches = self.iterMatches(query, searcher)
+            else:
+                matches = self._groupByLeaf(docIds, searcher)
+
+            for leaf, docBase, docs in matches:
+                readers = [_columnReader(leaf, column) for column in columns]
+                for doc in docs:
+                    values = [read(doc) for read in readers]
+                    if storedFields:
+                        values.extend(self.projectFields(searcher, docBase + doc, storedFields, fieldsToLoad))
+                    yield docBase + doc, tuple(values)
+
+
+    def hasField(self, name: str):
+        """Whether any document of the index has the field name, e.g. the optional "keyphrase" column"""
+        with self.acquire() as searcher:
+            return FieldInfos.getMergedFieldInfos(searcher.getIndexReader()).fieldInfo(name) is not None
+
+
+    def hasDocValues(self, name: str):
+        """Whether the field name is a doc values column, "venues" only is in indexes built since it was added"""
+        with self.acquire() as searcher:
+            info = FieldInfos.getMergedFieldInfos(searcher.getIndexReader()).fieldInfo(name)
+            return info is not None and info.getDocValuesType() != DocValuesType.NONE
+
+
+    def groupByColumn(self, query, column: str = "year", fields=("title",)):
+        """Stored fields of every doc matching query, bucketed by a doc values column, in one pass
+
+        Args:
+            query: lucene Query selecting the documents
+            column: single-valued name from doc_value_columns, e.g. "year"
+            fields: names of the stored fields to load
+
+        Returns:
+            dict: column value -> list of {field: value} dicts in index order,
+            docs without a value are grouped under None
+        """
+        fields = tuple(fields)
+        fieldsToLoad = HashSet()
+        for name in fields:
+            fieldsToLoad.add(name)
+        groups = {}
+        with self.acquire() as searcher:
+            for leaf, docBase, docs in self.iterMatches(query, searcher):
+                read = _columnReader(leaf, column)
+                for doc in docs:
+                    values = self.projectFields(searcher, docBase + doc, fields, fieldsToLoad)
+                    groups.setdefault(read(doc), []).append(
+                        {name: value for name, value in zip(fields, values) if value is not None})
+        return groups
+
+
+    def _groupByLeaf(self, docIds, searcher):
+        """Split sorted global doc ids into (leaf, docBase, leaf-local ids) like iterMatches"""
+        docIds = sorted(docIds)
+        start = 0
+        for context in searcher.getIndexReader().leaves():
+            leaf = context.reader()
+            end = start
+            while end < len(docIds) and docIds[end] < context.docBase + leaf.maxDoc():
+                end += 1
+            if end > start:
+                yield leaf, context.docBase, [doc - context.docBase for doc in docIds[start:end]]
+            start = end
+
+
+    def iterHits(self, query, limit: int = None, batchSize: int = 1000, searcher=None):
+        """Page through the hits of query with searchAfter
+
+        Every page of scored hits runs the query again, so their size doubles
+        from batchSize on, and a limit up to batchSize is a single search.
+
+        Args:
+            query: lucene Query
+            limit: number of best hits by score, None for every hit in index
+                order, so that each page resumes right after the previous one
+            batchSize: number of hits fetched by the first page, by every
+                page in index order
+            searcher: IndexSearcher acquired by the caller, which needs the
+                doc ids, the current one if None
+
+        Yields:
+            ScoreDoc of each hit
+        """
+        if searcher is None:
+            with self.acquire() as searcher:
+                yield from self.iterHits(query, limit, batchSize, searcher)
+            return
+        sort = Sort.INDEXORDER if limit is None else None
+        remaining = limit
+        after = None
+        pageSize = batchSize
+        while remaining is None or remaining > 0:
+            number = pageSize if remaining is None else min(pageSize, remaining)
+            if sort is None:
+                if after is None:
+                    topDocs = searcher.search(query, number)
                 else:
-                    temp_dict[field.name()] = field.stringValue()
-            if printing:
-                print(f'DocID: {scoreDoc.doc}')
-                print(f'Score: {scoreDoc.score}')
-                print(f'Rank: {index+1}')
-                
-                for key, value in temp_dict.items():
-                    if key == "key" or key == "mdate":
-                        continue
-                    elif key == "author":
-                        print(f"{key}: {(', '.join(value))}")
-                    else:
-                        print(f"{key}: {value}")
-                print()
-            reading_list.append(temp_dict)
-            
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        
-        print(f"Elapsed time: {elapsed_time:6f} seconds")
+                    topDocs = searcher.searchAfter(after, query, number)
+            else:
+                if after is None:
+                    topDocs = searcher.search(query, number, sort)
+                else:
+                    topDocs = searcher.searchAfter(after, query, number, sort)
+            scoreDocs = topDocs.scoreDocs
+            for scoreDoc in scoreDocs:
+                yield scoreDoc
+            if len(scoreDocs) < number:
+                return
+            after = scoreDocs[len(scoreDocs) - 1]
+            if remaining is not None:
+                remaining -= len(scoreDocs)
+                pageSize *= 2
+
+
+    def toDict(self, doc):
+        """Convert the stored fields of a lucene Document to a dict, authors as a list"""
+        temp_dict = {}
+        for field in doc.getFields():
+            if field.name() == "author":    
+                if temp_dict.get(field.name()) == None:
+                    temp_dict[field.name()] = list()
+                temp_dict[field.name()] = temp_dict.get(field.name()) + [field.stringValue()]
+            else:
+                temp_dict[field.name()] = field.stringValue()
+        return temp_dict
+
+
+    def projectFields(self, searcher, docId: int, fields: tuple, fieldsToLoad):
+        """Decode only the given stored fields of a doc
+
+        Args:
+            searcher: IndexSearcher the doc id comes from
+            docId: global doc id
+            fields: names of the stored fields, in output order
+            fieldsToLoad: java HashSet of the same names, given to the stored-field visitor
+
+        Returns:
+            list: one value per field, a list of names for "author" and None if missing
+        """
+        visitor = DocumentStoredFieldVisitor(fieldsToLoad)
+        searcher.doc(docId, visitor)
+        doc = visitor.getDocument()
+        values = []
+        for name in fields:
+            stored = doc.getValues(name)
+            if name == "author":
+                values.append(list(stored))
+            else:
+                values.append(stored[0] if len(stored) else None)
+        return values
+
+
+    def convertHits(self, query, limit: int, fields=None, compact: bool = False, searcher=None):
+        """Lazily convert the hits of query, see printResult for the arguments
+
+        Args:
+            searcher: IndexSearcher acquired by the caller, the current one if None
+
+        Yields:
+            (docId, score, result): result is a dict, or a namedtuple if compact
+        """
+        if searcher is None:
+            with self.acquire() as searcher:
+                yield from self.convertHits(query, limit, fields, compact, searcher)
+            return
+        if fields is not None:
+            fields = tuple(fields)
+            fieldsToLoad = HashSet()
+            for name in fields:
+                fieldsToLoad.add(name)
+            if compact:
+                Record = namedtuple("Record", fields, rename=True)
+
+        for scoreDoc in self.iterHits(query, limit, searcher=searcher):
+            if fields is None:
+                result = self.toDict(searcher.doc(scoreDoc.doc))
+            else:
+                values = self.projectFields(searcher, scoreDoc.doc, fields, fieldsToLoad)
+                if compact:
+                    result = Record(*values)
+                else:
+                    result = {name: value for name, value in zip(fields, values) if value is not None}
+            yield scoreDoc.doc, scoreDoc.score, result
+
+
+    def outputSinks(self, printing: bool, save_to_local: bool, file_name: str, sinks=None):
+        """Sinks of one search: the given ones, then the console and the JSON export if enabled"""
+        sinks = list(sinks) if sinks else []
+        if printing:
+            sinks.append(ConsoleSink())
         if save_to_local:
-            with open(file_name, "w", encoding="utf-8") as file:
-                for item in reading_list:
-                    file.write(json.dumps(item) + '\n')
-            file.close()
+            sinks.append(JsonLinesSink(file_name))
+        return sinks
+
+
+    def iterResults(self, hits, limit: int, sinks, name: str):
+        """Pass converted hits through the output sinks and the timing hooks
 
-        return reading_list
+        Args:
+            hits: (docId, score, result) hits, see convertHits
+            limit: number of results requested, None for all of them
+            sinks: ResultSinks receiving every result
+            name: name of the search given to the sinks and timing hooks
+
+        Yields:
+            result of each hit
+        """
+        timed = self.timingHook is not None or logger.isEnabledFor(logging.DEBUG)
+        if not sinks and not timed:
+            # nothing to report, no per-hit work
+            for docId, score, result in hits:
+                yield result
+            return
+
+        start = time.perf_counter()
+        for sink in sinks:
+            sink.begin(name, limit)
+        count = 0
+        try:
+            for docId, score, result in hits:
+                count += 1
+                for sink in sinks:
+                    sink.write(count, docId, score, result)
+                yield result
+        finally:
+            elapsed = time.perf_counter() - start
+            for sink in sinks:
+                sink.end(count, elapsed)
+            if timed:
+                logger.debug("%s: %d results in %.6f seconds", name, count, elapsed)
+                if self.timingHook is not None:
+                    self.timingHook(name, count, elapsed)
+
+
+    def printResult(self, query, return_all:bool, save_to_local:bool, file_name:str, topK:int, printing:bool=False, lazy:bool=False,
+                    fields=None, compact:bool=False, sinks=None):
+        """ Convert the hits of query to dicts, without any output unless asked for
+            return_all: every hit in index order instead of the topK best ones
+            save_to_local: write the results as JSON lines to file_name
+            printing: print the results to the console
+            lazy: return a generator that pages through the hits, so any
+                number of hits is converted in constant memory
+            fields: names of the stored fields to load, all of them if None
+            compact: with fields, return namedtuples in fields order instead
+                of dicts (None or [] for missing values)
+            sinks: more ResultSinks receiving the results
+
+        Returns:
+            list[map] (generator if lazy): the matching docs
+        """
+        if compact and fields is None:
+            raise ValueError("compact results need a fields projection")
+        limit = None if return_all else topK
+        hits = self.convertHits(query, limit, fields, compact)
+        results = self.iterResults(hits, limit, self.outputSinks(printing, save_to_local, file_name, sinks),
+                                   os.path.splitext(file_name)[0])
+        if lazy:
+            return results
+        return list(results)
 
 
-    def searchByYearRange(self, start: int, end: int, return_all=False, save_to_local=False, printing=True, top_k=None):
+    def generation(self, searcher=None):
+        """Version of the index a searcher reads, changes with every commit
+
+        Args:
+            searcher: acquired IndexSearcher, the current one if None
+        """
+        if searcher is None:
+            with self.acquire() as searcher:
+                return self.generation(searcher)
+        return DirectoryReader.cast_(searcher.getIndexReader()).getVersion()
+
+
+    def cachedResult(self, params: tuple, buildQuery, return_all:bool, save_to_local:bool, file_name:str, topK:int,
+                     printing:bool=False, lazy:bool=False, fields=None, compact:bool=False, sinks=None):
+        """printResult through the result cache, the query is only built on a miss
+
+        Args:
+            params: normalized search parameters, part of the cache key
+            buildQuery: function returning the lucene Query
+        """
+        # return_all results are too large to be held twice, in the cache and copied out of it
+        if self.cache is None or lazy or return_all:
+            return self.printResult(buildQuery(), return_all, save_to_local, file_name, topK, printing, lazy, fields, compact, sinks)
+        if compact and fields is None:
+            raise ValueError("compact results need a fields projection")
+
+        limit = None if return_all else topK
+        key = (params, limit, tuple(fields) if fields is not None else None, compact)
+        with self.acquire() as searcher:
+            generation = self.generation(searcher)
+            hits = self.cache.get(key, generation)
+            if hits is None:
+                hits = list(self.convertHits(buildQuery(), limit, fields, compact, searcher))
+                self.cache.put(key, hits, generation, _estimateSize(hits))
+        hits = [(docId, score, _copyResult(result)) for docId, score, result in hits]
+        return list(self.iterResults(hits, limit, self.outputSinks(printing, save_to_local, file_name, sinks),
+                                     os.path.splitext(file_name)[0]))
+
+
+    def cachedCount(self, params: tuple, buildQuery):
+        """count through the result cache, the query is only built on a miss"""
+        if self.cache is None:
+            return self.count(buildQuery())
+        key = ("count", params)
+        with self.acquire() as searcher:
+            generation = self.generation(searcher)
+            count = self.cache.get(key, generation)
+            if count is None:
+                count = searcher.count(buildQuery())
+                self.cache.put(key, count, generation, 64)
+        return count
+
+
+    def cacheStats(self):
+        """Hit/miss statistics of the result cache, None if it is disabled"""
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+
+    def queryParser(self, field: str):
+        """Classic QueryParser of field owned by the calling thread, created once per thread"""
+        parsers = getattr(self._local, "parsers", None)
+        if parsers is None:
+            parsers = self._local.parsers = {}
+        parser = parsers.get(field)
+        if parser is None:
+            parser = parsers[field] = QueryParser(field, self.analyzer)
+        return parser
+
+
+    def compiledQuery(self, field: str, text: str, build):
+        """Query built from normalized text, memoized by (field, normalized text)
+
+        Args:
+            field: name of the query kind, part of the cache key
+            text: user input, whitespace is collapsed before building
+            build: function of the normalized text returning the lucene Query
+        """
+        text = _normalize(text)
+        if self.queryCache is None:
+            return build(text)
+        key = (field, text)
+        query = self.queryCache.get(key)
+        if query is None:
+            query = build(text)
+            self.queryCache.put(key, query)
+        return query
+
+
+    def queryCacheStats(self):
+        """Hit/miss statistics of the parsed query cache, None if it is disabled"""
+        if self.queryCache is None:
+            return None
+        return self.queryCache.stats()
+
+
+    def yearRangeQuery(self, start: int, end: int):
+        """Query of the docs published within [start, end], or in start if end is None"""
+        if end:
+            return IntPoint.newRangeQuery("year", start, end)
+        else:
+            return IntPoint.newRangeQuery("year", start, start)
+
+
+    def confQuery(self, conf: str):
+        """Constant-score query of the docs published in venue conf
+
+        conf is matched exactly, after normalization, against the venue of
+        the dblp key (e.g. "aaai" or "conf/aaai") and the booktitle/journal.
+        """
+        return self.compiledQuery("venue", conf, self._buildConfQuery)
+
+
+    def _buildConfQuery(self, conf: str):
+        term = venueQueryTerm(conf)
+        if term is None:
+            return MatchNoDocsQuery()
+        return ConstantScoreQuery(TermQuery(Term("venues", term)))
+
+
+    def keywordQuery(self, key: str):
+        """Query of the docs whose title matches key, see CustomQueryParser"""
+        # query_parser = QueryParser('title', self.analyzer)
+        # the parser upper-cases its input
+        return self.compiledQuery("title", key.upper(), self.titleParser.parse)
+
+
+    def authorQuery(self, author: str):
+        """Query of the docs written by author"""
+        return self.compiledQuery("author", author, lambda text: self.queryParser('author').parse(text))
+
+
+    def anyTermQuery(self, field: str, text: str):
+        """Query of the docs whose field contains any analyzed term of text, e.g. to narrow candidates"""
+        def build(text):
+            stream = self.analyzer.tokenStream(field, text)
+            term_att = stream.addAttribute(CharTermAttribute.class_)
+            stream.reset()
+            query_builder = BooleanQuery.Builder()
+            while stream.incrementToken():
+                query_builder.add(TermQuery(Term(field, term_att.toString())), BooleanClause.Occur.SHOULD)
+            stream.end()
+            stream.close()
+            return query_builder.build()
+
+        return self.compiledQuery("any " + field, text, build)
+
+
+    def multiFieldQuery(self, start: int=None, end: int=None, conf: str=None, key :str=None, author :str=None):
+        """Query of the docs matching every given condition, see multiFieldSearch"""
+        boolean_query = BooleanQuery.Builder()
+        if key:
+            boolean_query.add(self.keywordQuery(key), BooleanClause.Occur.MUST)
+        if author:
+            boolean_query.add(self.authorQuery(author), BooleanClause.Occur.MUST)        
+        if conf:
+            # not scored, lucene caches the matching docs of frequent filters
+            boolean_query.add(self.confQuery(conf), BooleanClause.Occur.FILTER)
+        if start:
+            boolean_query.add(self.yearRangeQuery(start, end), BooleanClause.Occur.MUST)
+        return boolean_query.build()
+
+
+    def count(self, query):
+        """Number of docs matching query, without scoring or loading any of them"""
+        with self.acquire() as searcher:
+            return searcher.count(query)
+
+
+    def docIdSet(self, query):
+        """Global doc ids of the docs matching query, without scoring or loading them
+
+        Returns:
+            list[int]: sorted doc ids, e.g. for readColumns(docIds=...), they
+            may point to other docs after the next refresh
+        """
+        docIds = []
+        for leaf, docBase, docs in self.iterMatches(query):
+            docIds.extend(docBase + doc for doc in docs)
+        return docIds
+
+
+    def searchByYearRange(self, start: int, end: int, return_all=False, save_to_local=False, printing=False, top_k=None, lazy=False, fields=None, compact=False, sinks=None):
         """
         Args:
             start (int): start year
             end (int): end year
             return_all(bool): should return all relevant result or TopK
             save_to_local(bool): shoulld save to local file?
+            lazy(bool): return a generator of docs instead of a list
+            fields(list): only load these stored fields
+            compact(bool): with fields, return namedtuples instead of dicts
+            printing(bool): print the results to the console
+            sinks(list): more ResultSinks receiving the results
 
         Returns:
             list[map]: all docs within given year range [start, end)
         """
         if top_k == None:
             top_k = self.topK
-        if end:
-            query = IntPoint.newRangeQuery("year", start, end)
-        else:
-            query = IntPoint.newRangeQuery("year", start, start)
+        return self.cachedResult(("year", start, end), lambda: self.yearRangeQuery(start, end),
+                                 return_all, save_to_local, f"yearrange-{start},{end}.json", top_k, printing, lazy, fields, compact, sinks)
+
 
-        return self.printResult(query, return_all, save_to_local, f"yearrange-{start},{end}.json", top_k, printing)
+    def countByYearRange(self, start: int, end: int):
+        """Number of docs published within [start, end], see searchByYearRange"""
+        return self.cachedCount(("year", start, end), lambda: self.yearRangeQuery(start, end))
 
 
-    def searchByConf(self, conf: str, return_all=False, save_to_local=False, printing=True, top_k=None):
+    def docIdSetByYearRange(self, start: int, end: int):
+        """Sorted doc ids of the docs published within [start, end], see docIdSet"""
+        return self.docIdSet(self.yearRangeQuery(start, end))
+
+
+    def searchByConf(self, conf: str, return_all=False, save_to_local=False, printing=False, top_k=None, lazy=False, fields=None, compact=False, sinks=None):
         """
         Args:
             conf (int): venue name
             return_all(bool): should return all relevant result or TopK
             save_to_local(bool): shoulld save to local file?
+            lazy(bool): return a generator of docs instead of a list
+            fields(list): only load these stored fields
+            compact(bool): with fields, return namedtuples instead of dicts
+            printing(bool): print the results to the console
+            sinks(list): more ResultSinks receiving the results
 
         Returns:
             list[map]: all docs within given year range [start, end)
@@ -182,61 +906,88 @@ class Searher(object):
         if top_k == None:
             top_k = self.topK
 
-        # query_parser = QueryParser('key', self.analyzer)
-        key_query = TermQuery(Term('key',conf))
-        # key_query.setBoost(2.0)
+        return self.cachedResult(("conf", _normalize(conf)), lambda: self.confQuery(conf),
+                                 return_all, save_to_local, f"conf-{conf}.json", top_k, printing, lazy, fields, compact, sinks)
 
-        booktitle_query = QueryParser('booktitle',self.analyzer).parse(conf)
-        
-        journal_query = QueryParser('journal', self.analyzer).parse(conf)
 
-        boolean_query = BooleanQuery.Builder()
-        boolean_query.add(key_query, BooleanClause.Occur.SHOULD)
-        boolean_query.add(booktitle_query, BooleanClause.Occur.SHOULD)
-        boolean_query.add(journal_query, BooleanClause.Occur.SHOULD)
+    def countByConf(self, conf: str):
+        """Number of docs of a venue, see searchByConf"""
+        return self.cachedCount(("conf", _normalize(conf)), lambda: self.confQuery(conf))
+
 
-        return self.printResult(boolean_query.build(), return_all, save_to_local, f"conf-{conf}.json", top_k, printing)
+    def docIdSetByConf(self, conf: str):
+        """Sorted doc ids of the docs of a venue, see docIdSet"""
+        return self.docIdSet(self.confQuery(conf))
 
     
-    def searchByKeyword(self, key:str, return_all=False, save_to_local=False, printing=True, top_k=None):
+    def searchByKeyword(self, key:str, return_all=False, save_to_local=False, printing=False, top_k=None, lazy=False, fields=None, compact=False, sinks=None):
         """ 
         Args:
             key (str): keyword, or phrase
             return_all(bool): should return all relevant result or TopK
             save_to_local(bool): shoulld save to local file?
+            lazy(bool): return a generator of docs instead of a list
+            fields(list): only load these stored fields
+            compact(bool): with fields, return namedtuples instead of dicts
+            printing(bool): print the results to the console
+            sinks(list): more ResultSinks receiving the results
 
         Returns:
             list[map]: all docs within given year range [start, end)
         """
         if top_k == None:
             top_k = self.topK
-        # query_parser = QueryParser('title', self.analyzer)
-        query_parser = CustomQueryParser('title',self.analyzer)
-        query = query_parser.parse(key)
-        print(query)
+        def buildQuery():
+            query = self.keywordQuery(key)
+            logger.debug("keyword query: %s", query)
+            return query
 
-        return self.printResult(query, return_all, save_to_local, f"keyword-{key}.json", top_k, printing)
+        return self.cachedResult(("keyword", _normalize(key)), buildQuery,
+                                 return_all, save_to_local, f"keyword-{key}.json", top_k, printing, lazy, fields, compact, sinks)
+
+
+    def countByKeyword(self, key: str):
+        """Number of docs whose title matches a keyword or phrase, see searchByKeyword"""
+        return self.cachedCount(("keyword", _normalize(key)), lambda: self.keywordQuery(key))
+
+
+    def docIdSetByKeyword(self, key: str):
+        """Sorted doc ids of the docs whose title matches a keyword or phrase, see docIdSet"""
+        return self.docIdSet(self.keywordQuery(key))
         
 
-    def searchByAuthor(self, author:str, return_all=False, save_to_local=False, printing=True, top_k=None):
+    def searchByAuthor(self, author:str, return_all=False, save_to_local=False, printing=False, top_k=None, lazy=False, fields=None, compact=False, sinks=None):
         """
         Args:
             author (str): author name query
             return_all(bool): should return all relevant result or TopK
             save_to_local(bool): shoulld save to local file?
+            lazy(bool): return a generator of docs instead of a list
+            fields(list): only load these stored fields
+            compact(bool): with fields, return namedtuples instead of dicts
+            printing(bool): print the results to the console
+            sinks(list): more ResultSinks receiving the results
 
         Returns:
             list[map]: all docs within given year range [start, end)
         """
         if top_k == None:
             top_k = self.topK
-        query_parser = QueryParser('author', self.analyzer)
-        query = query_parser.parse(author)
+        return self.cachedResult(("author", _normalize(author)), lambda: self.authorQuery(author),
+                                 return_all, save_to_local, f"author-{author}.json", top_k, printing, lazy, fields, compact, sinks)
+
+
+    def countByAuthor(self, author: str):
+        """Number of docs of an author, see searchByAuthor"""
+        return self.cachedCount(("author", _normalize(author)), lambda: self.authorQuery(author))
 
-        return self.printResult(query, return_all, save_to_local, f"author-{author}.json", top_k, printing)
 
+    def docIdSetByAuthor(self, author: str):
+        """Sorted doc ids of the docs of an author, see docIdSet"""
+        return self.docIdSet(self.authorQuery(author))
 
-    def multiFieldSearch(self, start: int=None, end: int=None, conf: str=None, key :str=None, author :str=None, return_all=False, save_to_local=False, printing=True, top_k = None):
+
+    def multiFieldSearch(self, start: int=None, end: int=None, conf: str=None, key :str=None, author :str=None, return_all=False, save_to_local=False, printing=False, top_k = None, lazy=False, fields=None, compact=False, sinks=None):
         """
         Args:
             start (int): start year
@@ -245,37 +996,123 @@ class Searher(object):
             key (str): keyword search
             author (str): author name search 
             return_all(bool): should return all relevant result or TopK
+            lazy(bool): return a generator of docs instead of a list
+            fields(list): only load these stored fields
+            compact(bool): with fields, return namedtuples instead of dicts
+            printing(bool): print the results to the console
+            sinks(list): more ResultSinks receiving the results
 
         Returns:
             list[map]: all docs within given condition
         """
         if top_k == None:
             top_k = self.topK
-        # print()
-        boolean_query = BooleanQuery.Builder()
-        if key:
-            query_parser = CustomQueryParser('title',self.analyzer).parse(key)
-            boolean_query.add(query_parser, BooleanClause.Occur.MUST)
-        if author:
-            query_parser = QueryParser("author", self.analyzer).parse(author)
-            boolean_query.add(query_parser, BooleanClause.Occur.MUST)        
-        if conf:
-            key_query = TermQuery(Term('key',conf))
-            booktitle_query = QueryParser('booktitle',self.analyzer).parse(conf)
-            journal_query = QueryParser('journal', self.analyzer).parse(conf)
-            boolean_conf_query = BooleanQuery.Builder()
-            boolean_conf_query.add(key_query, BooleanClause.Occur.SHOULD)
-            boolean_conf_query.add(booktitle_query, BooleanClause.Occur.SHOULD)
-            boolean_conf_query.add(journal_query, BooleanClause.Occur.SHOULD)
-            boolean_query.add(boolean_conf_query.build(), BooleanClause.Occur.MUST)
-        if start:
-            if end:
-                year_query = IntPoint.newRangeQuery("year", start, end)
-            else:
-                year_query = IntPoint.newRangeQuery("year", start, start)
-            boolean_query.add(year_query, BooleanClause.Occur.MUST)
+        params = ("multi", start or None, end or None, _normalize(conf) or None, _normalize(key) or None, _normalize(author) or None)
+
+        return self.cachedResult(params, lambda: self.multiFieldQuery(start, end, conf, key, author),
+                                 return_all, save_to_local, f"multi-{start}-{end}-{conf}-{key}-{author}.json", topK=top_k, printing = printing, lazy = lazy, fields = fields, compact = compact, sinks = sinks)
+
+
+    def countByMultiField(self, start: int=None, end: int=None, conf: str=None, key :str=None, author :str=None):
+        """Number of docs matching all the given conditions, see multiFieldSearch"""
+        params = ("multi", start or None, end or None, _normalize(conf) or None, _normalize(key) or None, _normalize(author) or None)
+        return self.cachedCount(params, lambda: self.multiFieldQuery(start, end, conf, key, author))
+
+
+    def docIdSetByMultiField(self, start: int=None, end: int=None, conf: str=None, key :str=None, author :str=None):
+        """Sorted doc ids of the docs matching all the given conditions, see docIdSet"""
+        return self.docIdSet(self.multiFieldQuery(start, end, conf, key, author))
+
+
+    def runSearch(self, method: str, params: dict):
+        """Run the search described by a spec, without printing or exporting
+
+        Args:
+            method: key of search_methods, e.g. "author"
+            params: its search parameters and search_options, strings are
+                converted, e.g. {"author": "Ofra Amir", "top_k": "5"}
 
-        return self.printResult(boolean_query.build(), return_all, save_to_local, f"multi-{start}-{end}-{conf}-{key}-{author}.json", topK=top_k, printing = printing)
+        Returns:
+            list[map]: the matching docs
+
+        Raises:
+            ValueError: the spec is invalid, e.g. an unknown parameter or a
+                query that does not parse
+        """
+        if method not in search_methods:
+            raise ValueError(f"unknown search method {method!r}, expected one of {sorted(search_methods)}")
+        name, arguments = search_methods[method]
+        kwargs = {}
+        for key, value in params.items():
+            convert = arguments.get(key) or search_options.get(key)
+            if convert is None:
+                raise ValueError(f"unknown parameter {key!r} for {method}")
+            try:
+                kwargs[key] = convert(value) if value is not None else None
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid value {value!r} for parameter {key!r}")
+        try:
+            return getattr(self, name)(save_to_local=False, printing=False, **kwargs)
+        except lucene.JavaError as e:
+            if ParseException.instance_(e.getJavaException()):
+                raise ValueError(f"invalid query: {e.getJavaException().getMessage()}")
+            raise
+
+
+    def searchBatch(self, specs, output: str = None, workers: int = 4):
+        """Run many searches on a pool of threads and write their results as JSON lines
+
+        Args:
+            specs: search specs, dicts with a "method" and its parameters, e.g.
+                {"method": "keyword", "key": "graph", "fields": ["title"]}
+            output: JSONL file, one {"index", "spec", "count", "results"} line
+                per spec in input order ("error" instead for a failed spec),
+                None to only measure
+            workers: number of threads, all attached to the JVM
+
+        Returns:
+            dict: throughput report, number of specs, hits, queries per second
+            and latency percentiles in seconds
+        """
+        specs = list(specs)
+        latency = LatencyStats()
+
+        def run(spec):
+            start = time.perf_counter()
+            # a failed spec is recorded in its line, the rest of the batch still runs
+            try:
+                params = dict(spec)
+                method = params.pop("method", None)
+                results, error = self.runSearch(method, params), None
+            except ValueError as e:
+                results, error = None, str(e)
+            except Exception as e:
+                results, error = None, f"{type(e).__name__}: {e}"
+            latency.record(time.perf_counter() - start, error is not None)
+            return results, error
+
+        hits = 0
+        start = time.time()
+        with ThreadPoolExecutor(workers, thread_name_prefix="batch", initializer=attachThread) as pool, \
+                (open(output, "w", encoding="utf-8") if output else nullcontext()) as file:
+            for index, (spec, (results, error)) in enumerate(zip(specs, pool.map(run, specs))):
+                if results is not None:
+                    hits += len(results)
+                if file is None:
+                    continue
+                line = {"index": index, "spec": spec}
+                if error is not None:
+                    line["error"] = error
+                else:
+                    line["count"] = len(results)
+                    line["results"] = [result if isinstance(result, dict) else result._asdict() for result in results]
+                file.write(json.dumps(line) + "\n")
+
+        report = latency.report()
+        report["elapsed"] = time.time() - start
+        report["queries_per_sec"] = len(specs) / report["elapsed"] if report["elapsed"] > 0 else 0.0
+        report.update({"specs": len(specs), "hits": hits, "workers": workers})
+        return report
 
 
     def multiField(self, return_all=False, save_to_local=False):
@@ -293,7 +1130,7 @@ class Searher(object):
             start = int(start)
         if end:
             end = int(end)
-        return self.multiFieldSearch(start=start, end=end, conf=conf, key=title, author=author, return_all=return_all, save_to_local=save_to_local, top_k=top_k)
+        return self.multiFieldSearch(start=start, end=end, conf=conf, key=title, author=author, return_all=return_all, save_to_local=save_to_local, top_k=top_k, printing=True)
 
 
 if __name__ == "__main__":
@@ -302,7 +1139,8 @@ if __name__ == "__main__":
     storeDir = "./index/"
     topK = 20
 
-    searcher = Searher(store_dir = storeDir, topK = topK)
+    # pick up re-indexed data without restarting
+    searcher = Searher(store_dir = storeDir, topK = topK, refreshInterval = 10)
 
     while True:
         print()
@@ -334,7 +1172,7 @@ if __name__ == "__main__":
                 top_k = int(top_k)
             else:
                 top_k = None
-            searcher.searchByYearRange(start_year, end_year, top_k=top_k)
+            searcher.searchByYearRange(start_year, end_year, top_k=top_k, printing=True)
 
         elif option == "2":
             key = input("Please enter the conference name: ")
@@ -343,7 +1181,7 @@ if __name__ == "__main__":
                 top_k = int(top_k)
             else:
                 top_k = None
-            searcher.searchByConf(key, top_k=top_k)
+            searcher.searchByConf(key, top_k=top_k, printing=True)
 
         elif option == "3":
             key = input("Please enter the title name: ")
@@ -352,7 +1190,7 @@ if __name__ == "__main__":
                 top_k = int(top_k)
             else:
                 top_k = None
-            searcher.searchByKeyword(key, top_k=top_k)
+            searcher.searchByKeyword(key, top_k=top_k, printing=True)
 
         elif option == "4":
             author = input("Please enter the author name: ")
@@ -361,7 +1199,7 @@ if __name__ == "__main__":
                 top_k = int(top_k)
             else:
                 top_k = None
-            searcher.searchByAuthor(author, top_k=top_k)
+            searcher.searchByAuthor(author, top_k=top_k, printing=True)
 
         elif option == "5":
             searcher.multiField()
@@ -371,6 +1209,8 @@ if __name__ == "__main__":
         else:
             print("Invalid option. Please try again.")
 
+    searcher.close()
+
     # sys.stdout.close()
     # sys.stdout = sys.__stdout__
 
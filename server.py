@@ -0,0 +1,211 @@
+""" Query Server
+
+Serves the searches of Searher as HTTP/JSON from one process holding the index.
+Requests are handled by a fixed pool of threads attached to the JVM, which all
+share the same IndexSearcher.
+
+Usage
+-----
+$ python server.py --port 8080 --workers 8
+
+$ curl 'localhost:8080/search?method=author&author=Ofra%20Amir&top_k=5'
+$ curl -X POST localhost:8080/search -d '{"method": "multi", "params": {"conf": "AAAI", "start": 2020, "key": "graph"}}'
+$ curl localhost:8080/stats
+
+$ python server.py --batch specs.jsonl --output results.jsonl --workers 8
+"""
+
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from query import Searher, attachThread, search_options
+from utils.metrics import LatencyStats
+
+
+class SearchService(object):
+    """Runs searches of a shared Searher on a pool of JVM-attached threads"""
+
+    def __init__(self, searcher: Searher, workers: int = 8, maxResults: int = 1000):
+        """
+        Args:
+            searcher: Searher shared by all workers
+            workers: number of threads running searches
+            maxResults: largest top_k served, return_all is refused, so that
+                one request cannot convert the whole index in memory
+        """
+        self.searcher = searcher
+        self.maxResults = maxResults
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="search", initializer=attachThread)
+        self.latency = LatencyStats()
+
+    def checkLimits(self, params: dict):
+        """Raise ValueError if a search would return more than maxResults docs"""
+        if params.get("return_all") is not None and search_options["return_all"](params["return_all"]):
+            raise ValueError(f"return_all is not served, ask for at most {self.maxResults} results with top_k")
+        if params.get("top_k") is not None:
+            try:
+                top_k = search_options["top_k"](params["top_k"])
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid value {params['top_k']!r} for parameter 'top_k'")
+            if top_k > self.maxResults:
+                raise ValueError(f"top_k {top_k} is larger than the {self.maxResults} results served")
+
+    def search(self, method: str, params: dict):
+        """Run one search on the calling thread, which must be attached
+
+        Args:
+            method, params: see Searher.runSearch
+
+        Returns:
+            list[map]: the matching docs
+
+        Raises:
+            ValueError: invalid search, or too many results, see checkLimits
+        """
+        self.checkLimits(params)
+        start = time.perf_counter()
+        error = True
+        try:
+            results = self.searcher.runSearch(method, params)
+            error = False
+            return results
+        finally:
+            self.latency.record(time.perf_counter() - start, error)
+
+    def submit(self, method: str, params: dict):
+        """Run one search on the pool
+
+        Returns:
+            Future: of the search result
+        """
+        return self.pool.submit(self.search, method, params)
+
+    def stats(self):
+        """Throughput and latency percentiles of the searches so far, with the cache statistics"""
+        report = self.latency.report()
+        report["cache"] = self.searcher.cacheStats()
+        report["query_cache"] = self.searcher.queryCacheStats()
+        report["docs"] = self.searcher.NumOfDocs
+        return report
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """GET /search?method=...&<params>, POST /search {"method": ..., "params": {...}}, GET /stats"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self.reply(200, self.server.service.stats())
+        elif url.path == "/search":
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self.handleSearch(params.pop("method", None), params)
+        else:
+            self.reply(404, {"error": f"unknown path {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/search":
+            self.reply(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except json.JSONDecodeError as e:
+            self.reply(400, {"error": f"invalid JSON: {e}"})
+            return
+        if not isinstance(body, dict):
+            self.reply(400, {"error": "the body must be a JSON object"})
+            return
+        self.handleSearch(body.get("method"), body.get("params", {}))
+
+    def handleSearch(self, method, params):
+        start = time.perf_counter()
+        if not isinstance(params, dict):
+            self.reply(400, {"error": "params must be a JSON object"})
+            return
+        try:
+            results = self.server.service.search(method, params)
+        except ValueError as e:
+            self.reply(400, {"error": str(e)})
+            return
+        except Exception as e:
+            # the connection is answered whatever failed, see Searher.runSearch for the invalid requests
+            self.reply(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        results = [result if isinstance(result, dict) else result._asdict() for result in results]
+        self.reply(200, {"count": len(results), "elapsed": time.perf_counter() - start, "results": results})
+
+    def reply(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # one line per request on stderr would dominate the latency under load
+        pass
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer handling each connection on a thread of the SearchService pool"""
+
+    def __init__(self, address, service: SearchService):
+        super().__init__(address, SearchHandler)
+        self.service = service
+
+    def process_request(self, request, client_address):
+        self.service.pool.submit(self.processRequestThread, request, client_address)
+
+    def processRequestThread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve searches of the index as HTTP/JSON")
+    parser.add_argument("--index", default="./index/", help="directory of the index")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="threads serving requests")
+    parser.add_argument("--search-threads", type=int, default=0,
+                        help="java threads searching the segments of one query in parallel")
+    parser.add_argument("--top-k", type=int, default=20, help="default number of results")
+    parser.add_argument("--max-results", type=int, default=1000, help="largest top_k a request may ask for")
+    parser.add_argument("--refresh", type=float, default=10, help="seconds between checks for a re-indexed store, 0 to disable")
+    parser.add_argument("--batch", help="run the search specs of this JSONL file instead of serving, see Searher.searchBatch")
+    parser.add_argument("--output", help="JSONL file of the batch results")
+    args = parser.parse_args()
+
+    if args.batch:
+        searcher = Searher(store_dir=args.index, topK=args.top_k, searchThreads=args.search_threads)
+        with open(args.batch, encoding="utf-8") as file:
+            specs = [json.loads(line) for line in file if line.strip()]
+        report = searcher.searchBatch(specs, output=args.output, workers=args.workers)
+        searcher.close()
+        print(json.dumps(report, indent=2))
+        raise SystemExit(0)
+
+    searcher = Searher(store_dir=args.index, topK=args.top_k, refreshInterval=args.refresh, searchThreads=args.search_threads)
+    service = SearchService(searcher, workers=args.workers, maxResults=args.max_results)
+    server = PooledHTTPServer((args.host, args.port), service)
+    print(f"Serving {searcher.NumOfDocs} documents on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        searcher.close()
+        print(json.dumps(service.latency.report(), indent=2))
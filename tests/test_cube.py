@@ -0,0 +1,89 @@
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("numpy")
+
+from utils.cube import TrendCube, writeCube
+
+
+COUNTS = {
+    "keyphrase": {
+        ("aaai", 2020): Counter({"graph neural networks": 3, "deep learning": 5, "knowledge graphs": 3}),
+        ("aaai", 2021): Counter({"graph neural networks": 4, "large language models": 2, "deep learning": 1}),
+        ("aaai", 2022): Counter({"large language models": 7}),
+        ("ijcai", 2020): Counter({"planning": 2, "deep learning": 1}),
+    },
+    "author": {
+        ("aaai", 2020): Counter({"ofra amir": 2, "guni sharon": 2}),
+        ("aaai", 2021): Counter({"guni sharon": 1, "zoë müller": 3}),
+        ("ijcai", 2020): Counter({"ofra amir": 1}),
+    },
+}
+
+
+@pytest.fixture
+def cube(tmp_path):
+    writeCube(str(tmp_path), 7, COUNTS, "rake")
+    return TrendCube.load(str(tmp_path), 7)
+
+
+def expected(kind, venue, start, end):
+    total = Counter()
+    for year in range(start, end + 1):
+        total.update(COUNTS[kind].get((venue, year), {}))
+    return sorted(total.items(), key=lambda item: (-item[1], item[0]))
+
+
+def test_single_year_is_ranked_with_alphabetical_ties(cube):
+    assert cube.top("keyphrase", "aaai", 2020, 2020) == [
+        ("deep learning", 5), ("graph neural networks", 3), ("knowledge graphs", 3)]
+    assert cube.top("author", "aaai", 2020, 2020) == [("guni sharon", 2), ("ofra amir", 2)]
+
+
+def test_years_are_merged(cube):
+    for kind, venue in (("keyphrase", "aaai"), ("author", "aaai"), ("keyphrase", "ijcai")):
+        for start, end in ((2020, 2021), (2020, 2022), (2021, 2022), (2019, 2030)):
+            assert cube.top(kind, venue, start, end) == expected(kind, venue, start, end)
+    assert cube.top("keyphrase", "aaai", 2020, 2022)[0] == ("large language models", 9)
+
+
+def test_top_k(cube):
+    assert cube.top("keyphrase", "aaai", 2020, 2022, top_k=2) == expected("keyphrase", "aaai", 2020, 2022)[:2]
+    assert cube.top("keyphrase", "aaai", 2020, 2020, top_k=1) == [("deep learning", 5)]
+    assert cube.top("author", "aaai", 2020, 2021, top_k=0) == []
+
+
+def test_unknown_venue_and_years(cube):
+    assert cube.top("keyphrase", "neurips", 2020, 2022) == []
+    assert cube.top("keyphrase", "aaai", 1990, 2000) == []
+    assert cube.top("author", "aaai", 2022, 2022) == []
+
+
+def test_non_ascii_values_round_trip(cube):
+    assert ("zoë müller", 3) in cube.top("author", "aaai", 2021, 2021)
+
+
+def test_meta(cube):
+    assert cube.meta["generation"] == 7
+    assert cube.meta["source"] == "rake"
+    assert cube.meta["venues"] == 2
+
+
+def test_stale_or_missing_cube_is_not_loaded(tmp_path):
+    assert TrendCube.load(str(tmp_path), 7) is None
+    writeCube(str(tmp_path), 7, COUNTS)
+    assert TrendCube.load(str(tmp_path), 8) is None
+    assert TrendCube.load(str(tmp_path), 7) is not None
+
+
+def test_rewrite_replaces_the_previous_cube(tmp_path):
+    writeCube(str(tmp_path), 7, COUNTS)
+    writeCube(str(tmp_path), 8, {"keyphrase": {("aaai", 2020): Counter({"planning": 1})}})
+    cube = TrendCube.load(str(tmp_path), 8)
+    assert cube.top("keyphrase", "aaai", 2020, 2022) == [("planning", 1)]
+    assert cube.top("author", "aaai", 2020, 2022) == []
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import dblp
+
+
+DATA = bytes(range(256)) * 4096
+ETAG = '"dump-1"'
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves DATA with byte ranges, misbehaving as set in server.mode
+
+    modes:
+        full: answers every range completely
+        partial: answers at most a quarter of each requested range
+        drop: announces the whole range, then closes the connection halfway,
+            once for every requested offset
+        offset: answers a range starting one byte after the requested one
+        empty: answers every range without any data
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(DATA)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match is None or self.headers.get("If-Range") != ETAG:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(DATA)))
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+        first, last = int(match.group(1)), int(match.group(2))
+        mode = self.server.mode
+        if mode == "partial":
+            last = min(last, first + max((last - first + 1) // 4, 1) - 1)
+        elif mode == "offset":
+            first += 1
+        elif mode == "empty":
+            last = first - 1
+        body = DATA[first:last + 1]
+        self.server.requests += 1
+
+        self.send_response(206)
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(first, max(last, first), len(DATA)))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", ETAG)
+        drop = mode == "drop" and first not in self.server.dropped
+        if drop:
+            self.server.dropped.add(first)
+            self.send_header("Connection", "close")
+        self.end_headers()
+        if drop:
+            self.wfile.write(body[:len(body) // 2 + 1])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.mode = "full"
+    httpd.requests = 0
+    httpd.dropped = set()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def download(server, tmp_path, **options):
+    url = "http://127.0.0.1:{}/dblp.xml.gz".format(server.server_address[1])
+    filename = str(tmp_path / "dblp.xml.gz")
+    return dblp.download_file(url, filename, **options), filename
+
+
+@pytest.mark.parametrize("mode", ["full", "partial", "drop"])
+def test_download_completes_every_range(server, tmp_path, mode):
+    server.mode = mode
+    ok, filename = download(server, tmp_path, connections=4, checksum=hashlib.md5(DATA).hexdigest())
+    assert ok
+    with open(filename, "rb") as file:
+        assert file.read() == DATA
+    assert not os.path.exists(filename + ".part")
+    if mode != "full":
+        assert server.requests > 4
+
+
+def test_download_rejects_wrong_content_range(server, tmp_path):
+    server.mode = "offset"
+    ok, filename = download(server, tmp_path, connections=4)
+    assert not ok
+    assert not os.path.exists(filename)
+
+
+def test_download_resumes_after_interruption(server, tmp_path):
+    server.mode = "offset"
+    ok, filename = download(server, tmp_path, connections=2)
+    assert not ok
+    assert os.path.exists(filename + ".part")
+
+    server.mode = "partial"
+    ok, filename = download(server, tmp_path, connections=2, checksum=hashlib.md5(DATA).hexdigest())
+    assert ok
+    with open(filename, "rb") as file:
+        assert file.read() == DATA
+
+
+def test_download_fails_when_a_range_stops_progressing(server, tmp_path):
+    # the preallocated part file has the right size, the missing bytes must still be noticed
+    server.mode = "empty"
+    ok, filename = download(server, tmp_path, connections=4)
+    assert not ok
+    assert not os.path.exists(filename)
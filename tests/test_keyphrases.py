@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("rake_nltk")
+
+from utils import keyphrases
+
+
+TITLES = [
+    "Graph Neural Networks for Traffic Forecasting",
+    # RAKE finds "deep reinforcement learning" twice, punctuation always splits phrases
+    "Deep Reinforcement Learning: Theory, Deep Reinforcement Learning: Practice",
+    "A Survey of Graph Neural Networks",
+    "Robust Deep Reinforcement Learning with Adversarial Training",
+    "Adversarial Training for Graph Neural Networks, revisited",
+    "Efficient Transformers",
+    "Efficient Transformers for Long Documents",
+    "Contrastive Learning of Visual Representations",
+]
+
+
+@pytest.fixture(autouse=True)
+def stopwords():
+    try:
+        keyphrases.createRake()
+    except LookupError:
+        pytest.skip("the NLTK stopwords corpus is not installed")
+
+
+def groups():
+    # several groups and chunks of every size, with the same titles in different orders
+    return {year: [TITLES[(year + i) % len(TITLES)] for i in range(3 * year)] for year in range(1, 8)}
+
+
+def test_parallel_counts_match_the_serial_path():
+    serial = keyphrases.countKeyphrases(groups(), jobs=1)
+    parallel = keyphrases.countKeyphrases(groups(), jobs=3, chunkSize=2)
+    assert parallel == serial
+    assert {year: keyphrases.rankKeyphrases(counts) for year, counts in parallel.items()} == \
+        {year: keyphrases.rankKeyphrases(counts) for year, counts in serial.items()}
+    assert sum(serial[7].values()) > 0
+
+
+def test_chunk_size_does_not_change_counts():
+    expected = keyphrases.countKeyphrases(groups(), jobs=1)
+    for chunkSize in (1, 3, 1000):
+        assert keyphrases.countKeyphrases(groups(), jobs=1, chunkSize=chunkSize) == expected
+
+
+def test_repeated_phrase_counts_once_per_title():
+    title = TITLES[1]
+    assert keyphrases.extractKeyphrases([title]).count("deep reinforcement learning") == 2
+    assert keyphrases.titleKeyphrases(title).count("deep reinforcement learning") == 1
+
+    counts = keyphrases.countKeyphrases({None: [title, title, "Deep Reinforcement Learning"]})[None]
+    assert counts["deep reinforcement learning"] == 3
+
+
+def test_rank_breaks_ties_alphabetically():
+    ranked = keyphrases.rankKeyphrases({"b c": 2, "a c": 2, "d e": 5})
+    assert ranked == [("d e", 5), ("a c", 2), ("b c", 2)]
@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Least-recently-used mapping bounded by entries and by an estimated size
+
+    Entries are dropped all at once when the generation given to get/put
+    changes, e.g. the version of the index reader the values were read from.
+    Safe to share between threads.
+    """
+
+    def __init__(self, maxEntries: int = 1024, maxBytes: int = None):
+        """
+        Args:
+            maxEntries: maximum number of entries
+            maxBytes: maximum total of the sizes given to put, unbounded if None
+        """
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def _checkGeneration(self, generation):
+        if generation != self.generation:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.bytes = 0
+            self.generation = generation
+
+    def get(self, key, generation=None):
+        """Return the value cached for key, None on a miss"""
+        with self.lock:
+            self._checkGeneration(generation)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, generation=None, size: int = 1):
+        """Cache value for key, evicting the least recently used entries to stay within bounds"""
+        with self.lock:
+            self._checkGeneration(generation)
+            if self.maxBytes is not None and size > self.maxBytes:
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while len(self.entries) > self.maxEntries or (self.maxBytes is not None and self.bytes > self.maxBytes):
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
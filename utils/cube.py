@@ -0,0 +1,138 @@
+import json
+import os
+
+import numpy as np
+
+
+# dimensions counted per (venue, year)
+cube_kinds = ("keyphrase", "author")
+
+
+def _writeDictionary(path: str, kind: str, values: list):
+    """Store sorted strings as one UTF-8 blob and the offsets of each string, code = position"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    np.save(os.path.join(path, f"{kind}_offsets.npy"), offsets)
+    np.save(os.path.join(path, f"{kind}_strings.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+def writeCube(path: str, generation: int, counts: dict, source: str = None):
+    """Write a trend cube to the directory path, replacing the previous one
+
+    Args:
+        path: output directory
+        generation: version of the index the counts were read from
+        counts: kind from cube_kinds -> {(venue, year): Counter of values}
+        source: where the keyphrases came from, recorded in meta.json
+    """
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, "meta.json")
+    # a cube without meta.json is never opened, so a failed build is not read
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    venues = sorted({venue for kind in cube_kinds for venue, _ in counts.get(kind, {})})
+    venueCodes = {venue: code for code, venue in enumerate(venues)}
+    with open(os.path.join(path, "venues.json"), "w", encoding="utf-8") as file:
+        json.dump(venues, file)
+
+    sizes = {}
+    for kind in cube_kinds:
+        cells = counts.get(kind, {})
+        values = sorted({value for counter in cells.values() for value in counter})
+        codes = {value: code for code, value in enumerate(values)}
+        _writeDictionary(path, kind, values)
+
+        rows = []
+        index = []
+        for venue, year in sorted(cells):
+            # codes follow the sorted values, so ties end up in alphabetical order
+            ranked = sorted(((codes[value], count) for value, count in cells[(venue, year)].items()),
+                            key=lambda row: (-row[1], row[0]))
+            start = len(rows)
+            rows.extend(ranked)
+            index.append((venueCodes[venue], year, start, len(rows)))
+        np.save(os.path.join(path, f"{kind}_cells.npy"), np.array(rows, dtype=np.int64).reshape(-1, 2))
+        np.save(os.path.join(path, f"{kind}_index.npy"), np.array(index, dtype=np.int64).reshape(-1, 4))
+        sizes[kind] = {"values": len(values), "cells": len(rows)}
+
+    with open(meta_path, "w", encoding="utf-8") as file:
+        json.dump({"generation": generation, "source": source, "venues": len(venues), "sizes": sizes}, file, indent=2)
+
+
+class TrendCube(object):
+    """Counts per (venue, year, keyphrase) and (venue, year, author), written by writeCube
+
+    The cells and dictionaries are memory-mapped, opening a cube only reads
+    the (venue, year) index, and a lookup only decodes the values it returns.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as file:
+            self.meta = json.load(file)
+        with open(os.path.join(path, "venues.json"), encoding="utf-8") as file:
+            self.venues = {venue: code for code, venue in enumerate(json.load(file))}
+        self.cells = {}
+        self.index = {}
+        self.offsets = {}
+        self.strings = {}
+        for kind in cube_kinds:
+            self.cells[kind] = np.load(os.path.join(path, f"{kind}_cells.npy"), mmap_mode="r")
+            self.offsets[kind] = np.load(os.path.join(path, f"{kind}_offsets.npy"), mmap_mode="r")
+            self.strings[kind] = np.load(os.path.join(path, f"{kind}_strings.npy"), mmap_mode="r")
+            self.index[kind] = {(int(venue), int(year)): (int(start), int(end))
+                                for venue, year, start, end in np.load(os.path.join(path, f"{kind}_index.npy"))}
+
+    @classmethod
+    def load(cls, path: str, generation: int):
+        """Open the cube of path if it was built from this index generation
+
+        Returns:
+            TrendCube, or None if there is no cube or it is stale
+        """
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as file:
+            built = json.load(file).get("generation")
+        if built != generation:
+            print(f"Warning! the trend cube in {path} is stale (index version {built}, now {generation}), "
+                  "answering from the index")
+            return None
+        return cls(path)
+
+    def decode(self, kind: str, code: int):
+        offsets = self.offsets[kind]
+        return bytes(self.strings[kind][offsets[code]:offsets[code + 1]]).decode("utf-8")
+
+    def top(self, kind: str, venue: str, start: int, end: int, top_k: int = None):
+        """Values of kind counted over the years [start, end] of a venue
+
+        Args:
+            kind: name from cube_kinds
+            venue: "venues" term, see indexing.venueQueryTerm
+            top_k: number of values returned, all of them if None
+
+        Returns:
+            list[(value, count)]: by decreasing count, ties in alphabetical order
+        """
+        venueCode = self.venues.get(venue)
+        if venueCode is None:
+            return []
+        slices = [self.index[kind].get((venueCode, year)) for year in range(start, end + 1)]
+        slices = [self.cells[kind][first:last] for first, last in filter(None, slices)]
+        if not slices:
+            return []
+        if len(slices) == 1:
+            # rows of one year are already ranked
+            rows = slices[0][:top_k] if top_k is not None else slices[0]
+            return [(self.decode(kind, code), int(count)) for code, count in rows]
+
+        cells = np.concatenate(slices)
+        codes, inverse = np.unique(cells[:, 0], return_inverse=True)
+        totals = np.bincount(inverse, weights=cells[:, 1]).astype(np.int64)
+        order = np.lexsort((codes, -totals))
+        if top_k is not None:
+            order = order[:top_k]
+        return [(self.decode(kind, int(codes[i])), int(totals[i])) for i in order]
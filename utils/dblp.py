@@ -1,101 +1,360 @@
 import requests
 import sys
 import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from email.utils import formatdate
 from hurry.filesize import size
+from requests.adapters import HTTPAdapter
 import gzip
 import shutil
 
 
-def download_file(url: str, filename: str):
-    """Function to download file"""
+CHUNK_SIZE = 1024 * 1024
+# failed requests in a row after which a range is given up
+RETRIES = 3
 
-    downloaded = False
-    with open(filename, "wb") as file:
-        response = requests.get(url, stream=True)
-        length = response.headers.get("content-length")
-        # print(length)
-        print(response.status_code)
-        if response.status_code != 200:
-            print("Connection Error")
-            return False
-        if length is None:
-            print(
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "DBLP",
-                "Error downloading dataset",
-            )
-        else:
-            download = 0
-            length = int(length)
-            for data in response.iter_content(
-                chunk_size=max(int(length / 1000), 1024 * 1024)
-            ):
-                download += len(data)
-                file.write(data)
-                # print(50*download/length)
-                done = int(50 * download / length)
+
+def create_session(connections: int = 4):
+    """Create the pooled HTTP session shared by every request of a download"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connections, max_retries=3)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # byte ranges and sizes refer to the file as stored on the server
+    session.headers["Accept-Encoding"] = "identity"
+    return session
+
+
+def _read_json(filename: str):
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except ValueError:
+        return {}
+
+
+def _write_json(filename: str, data: dict):
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(temp_filename, filename)
+
+
+def _remove(*filenames):
+    for filename in filenames:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def _md5(filename: str):
+    digest = hashlib.md5()
+    with open(filename, "rb") as file:
+        for data in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _content_range(header):
+    """First byte, last byte and total length of a Content-Range header, None if it is not one"""
+    try:
+        unit, _, spec = header.partition(" ")
+        span, _, total = spec.partition("/")
+        first, _, last = span.partition("-")
+        if unit != "bytes":
+            return None
+        return int(first), int(last), None if total == "*" else int(total)
+    except (AttributeError, ValueError):
+        return None
+
+
+class _Progress(object):
+    """Progress bar shared by the download threads"""
+
+    def __init__(self, download: int, length):
+        self.download = download
+        self.length = length
+        self.lock = threading.Lock()
+
+    def update(self, count: int):
+        with self.lock:
+            self.download += count
+            if self.length:
+                done = int(50 * self.download / self.length)
                 sys.stdout.write(
                     "\r[{}{}] {}/{}".format(
-                        "█" * done, "." * (50 - done), size(download), size(length)
+                        "█" * done, "." * (50 - done), size(self.download), size(self.length)
                     )
                 )
-                sys.stdout.flush()
-            sys.stdout.write("\n")
-            downloaded = True
-    return downloaded
+            else:
+                sys.stdout.write("\r{}".format(size(self.download)))
+            sys.stdout.flush()
+
+    def finish(self):
+        sys.stdout.write("\n")
+
+
+def download_file(url: str, filename: str, session=None, connections: int = 4, checksum: str = None):
+    """Function to download file
+
+    The file is downloaded into filename.part, in parallel byte ranges when the
+    server supports them. The progress of every range is kept in
+    filename.part.json, so an interrupted download resumes where it stopped as
+    long as the server still has the same version (ETag or Last-Modified).
+    Ranges answered in part or cut off are requested again from the first
+    missing byte. The file only replaces filename once every range is
+    complete and its size and checksum are verified.
+
+    Args:
+        url: file to download
+        filename: local destination
+        session: requests session, see create_session
+        connections: number of parallel range requests
+        checksum: expected md5 hex digest of the file, not verified if None
+
+    Returns:
+        bool: True if the file was downloaded and verified
+    """
+    if session is None:
+        session = create_session(connections)
+    part_filename = filename + ".part"
+    state_filename = part_filename + ".json"
+
+    response = session.head(url, allow_redirects=True)
+    print(response.status_code)
+    if response.status_code != 200:
+        print("Connection Error")
+        return False
+    length = response.headers.get("content-length")
+    length = int(length) if length is not None else None
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    # weak ETags are not accepted by If-Range
+    validator = etag if etag and not etag.startswith("W/") else last_modified
+    ranged = length is not None and validator is not None and response.headers.get("Accept-Ranges") == "bytes"
 
+    state = _read_json(state_filename)
+    resumable = (
+        ranged
+        and os.path.exists(part_filename)
+        and state.get("validator") == validator
+        and state.get("length") == length
+    )
+    if resumable:
+        print("resuming download")
+    else:
+        if ranged:
+            step = -(-length // max(connections, 1))
+            ranges = [[start, min(start + step, length) - 1, 0] for start in range(0, length, step)]
+        else:
+            # no byte ranges, one request from the start
+            ranges = [[0, None, 0]]
+        state = {"validator": validator, "length": length, "ranges": ranges}
+        with open(part_filename, "wb") as file:
+            if ranged:
+                file.truncate(length)
+        _write_json(state_filename, state)
 
-def check_latest(url: str, filename: str):
-    """Check if the file in the local is the latest"""
+    lock = threading.Lock()
+    progress = _Progress(sum(done for _, _, done in state["ranges"]), length)
+
+    def fetch(index: int):
+        start, end, _ = state["ranges"][index]
+        # a server may answer with part of the range or drop the connection,
+        # the rest is requested again until a few requests in a row fail
+        failures = 0
+        while True:
+            done = state["ranges"][index][2]
+            if end is not None and start + done > end:
+                return
+            headers = {}
+            if ranged:
+                headers["Range"] = "bytes={}-{}".format(start + done, end)
+                # the server answers 200 with the whole file if it changed meanwhile
+                headers["If-Range"] = validator
+            received = 0
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=60) as response:
+                    if response.status_code != (206 if ranged else 200):
+                        raise IOError("unexpected status {} for {}".format(response.status_code, headers["Range"] if ranged else url))
+                    if ranged:
+                        content_range = _content_range(response.headers.get("Content-Range"))
+                        if content_range is None or content_range[0] != start + done or content_range[2] not in (None, length):
+                            raise IOError("unexpected Content-Range {} for {}".format(
+                                response.headers.get("Content-Range"), headers["Range"]))
+                    with open(part_filename, "r+b") as file:
+                        file.seek(start + done)
+                        for data in response.iter_content(chunk_size=CHUNK_SIZE):
+                            if end is not None:
+                                # never write over the next range
+                                data = data[:end + 1 - (start + done + received)]
+                            if not data:
+                                break
+                            file.write(data)
+                            file.flush()
+                            received += len(data)
+                            with lock:
+                                state["ranges"][index][2] += len(data)
+                                _write_json(state_filename, state)
+                            progress.update(len(data))
+            except requests.RequestException:
+                failures = 0 if received else failures + 1
+                if not ranged or failures >= RETRIES:
+                    raise
+                continue
+            if not ranged:
+                return
+            if received == 0:
+                raise IOError("no data received for {}".format(headers["Range"]))
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(state["ranges"])) as executor:
+        futures = [executor.submit(fetch, index) for index in range(len(state["ranges"]))]
+        for future in futures:
+            try:
+                future.result()
+            except (requests.RequestException, IOError) as error:
+                errors.append(error)
+    progress.finish()
+    if errors:
+        print(
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "DBLP",
+            "Download interrupted, run again to resume:",
+            errors[0],
+        )
+        return False
+
+    if length is not None:
+        # the part file is allocated up front, only the ranges tell what was written
+        incomplete = [
+            (start, end, done) for start, end, done in state["ranges"]
+            if done != (end if end is not None else length - 1) - start + 1
+        ]
+        if incomplete or os.path.getsize(part_filename) != length:
+            print("Size mismatch, expected {} bytes".format(length))
+            _remove(part_filename, state_filename)
+            return False
+    if checksum is not None and _md5(part_filename) != checksum.lower():
+        print("Checksum mismatch")
+        _remove(part_filename, state_filename)
+        return False
+
+    os.replace(part_filename, filename)
+    _remove(state_filename)
+    _write_json(filename + ".meta.json", {"etag": etag, "last_modified": last_modified, "length": length})
+    return True
+
+
+def fetch_checksum(url: str, session=None):
+    """Read the md5 digest published next to a file (e.g. dblp.xml.gz.md5), None if unavailable"""
+    if session is None:
+        session = create_session(1)
+    try:
+        response = session.get(url, timeout=60)
+    except requests.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    digest = response.text.split()[0].lower() if response.text.split() else ""
+    if len(digest) != 32 or any(c not in "0123456789abcdef" for c in digest):
+        return None
+    return digest
+
+
+def check_latest(url: str, filename: str, session=None):
+    """Check if the file in the local is the latest
+
+    Sends a conditional request with the ETag and Last-Modified saved by
+    download_file, or the local modification time.
+    """
     # Check if local file exists
     if not os.path.exists(filename):
         return False
+    if session is None:
+        session = create_session(1)
+
+    meta = _read_json(filename + ".meta.json")
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    headers["If-Modified-Since"] = meta.get("last_modified") or formatdate(os.path.getmtime(filename), usegmt=True)
+
+    try:
+        response = session.head(url, headers=headers, allow_redirects=True)
+    except requests.RequestException:
+        print("Connection Error, using the local file")
+        return True
+    if response.status_code == 304:
+        return True
+    if response.status_code != 200:
+        print("Connection Error, using the local file")
+        return True
+    if meta.get("etag") and response.headers.get("ETag") == meta["etag"]:
+        return True
 
-    response = requests.head(url)
-    # print(response)
     server_modified_time = response.headers.get("Last-Modified")
-    # print(server_modified_time)
+    if server_modified_time is None:
+        return False
     server_modified_time = datetime.strptime(
         server_modified_time, "%a, %d %b %Y %H:%M:%S %Z"
     )
 
     # Get the last modified time of the local file
-    local_modified_time = datetime.fromtimestamp(os.path.getmtime(filename))
+    local_modified_time = datetime.utcfromtimestamp(os.path.getmtime(filename))
 
     # Compare the last modified times
     return server_modified_time <= local_modified_time
 
 
-def download_dataset():
-    """Function to download the latest dump of the dataset and decompress
+def decompress_file(filename: str, unzip_filename: str):
+    """Decompress a .gz file"""
+    print("unzipping")
+    with gzip.open(filename, "rb") as file_in:
+        with open(unzip_filename, "wb") as file_out:
+            shutil.copyfileobj(file_in, file_out)
+    print("File downloaded and unzipped")
+
+
+def download_dataset(decompress: bool = False, base_url: str = "https://dblp.uni-trier.de/xml/", connections: int = 4):
+    """Function to download the latest dump of the dataset
     Args:
-        None
+        decompress: also write the decompressed dblp.xml, the indexer reads
+            dblp.xml.gz directly so this is only needed by other tools
+        base_url: location of dblp.dtd and dblp.xml.gz, e.g. a local mirror
+        connections: number of parallel connections of the dump download
     Returns:
-        None
+        str: path of the dump to index
     """
+    session = create_session(connections)
 
-    dtd_url = "https://dblp.uni-trier.de/xml/dblp.dtd"
+    dtd_url = base_url + "dblp.dtd"
     dtd_filename = "dblp.dtd"
-    if not check_latest(url=dtd_url, filename=dtd_filename):
-        download_file(url=dtd_url, filename=dtd_filename)
+    if not check_latest(url=dtd_url, filename=dtd_filename, session=session):
+        download_file(url=dtd_url, filename=dtd_filename, session=session, connections=1)
 
-    xml_url = "https://dblp.uni-trier.de/xml/dblp.xml.gz"
+    xml_url = base_url + "dblp.xml.gz"
     xml_filename = "dblp.xml.gz"
     unzip_xml_filename = "dblp.xml"
-    if not check_latest(url=xml_url, filename=xml_filename):
-        download_file(url=xml_url, filename=xml_filename)
-        print("unzipping")
-        with gzip.open(xml_filename, "rb") as file_in:
-            with open(unzip_xml_filename, "wb") as file_out:
-                shutil.copyfileobj(file_in, file_out)
-        print("File downloaded and unzipped")
+    if not check_latest(url=xml_url, filename=xml_filename, session=session):
+        checksum = fetch_checksum(xml_url + ".md5", session=session)
+        if checksum is None:
+            print("Warning! no checksum published for", xml_url)
+        if not download_file(url=xml_url, filename=xml_filename, session=session,
+                             connections=connections, checksum=checksum):
+            print("Failed to download", xml_url)
+        elif decompress:
+            decompress_file(xml_filename, unzip_xml_filename)
     else:
-        if not os.path.exists(unzip_xml_filename):
-            print("unzipping")
-            with gzip.open(xml_filename, "rb") as file_in:
-                with open(unzip_xml_filename, "wb") as file_out:
-                    shutil.copyfileobj(file_in, file_out)
-            print("File downloaded and unzipped")
+        if decompress and not os.path.exists(unzip_xml_filename):
+            decompress_file(xml_filename, unzip_xml_filename)
         else:
             print("Local File is the latest version")
+    if decompress:
+        return unzip_xml_filename
+    return xml_filename
@@ -0,0 +1,83 @@
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from rake_nltk import Rake
+
+
+# phrases containing one of these words are not research topics
+stop_words = ['abstract', 'approach', 'commitee', 'report', 'study', 'paper']
+
+
+def createRake():
+    """Rake extractor with the settings of the trend analytics, reusable across calls"""
+    return Rake(min_length=2, max_length=4)
+
+
+def extractKeyphrases(titles: list, rake=None):
+    """RAKE keyphrases of titles, each title being one sentence, without the stop_words ones
+
+    Args:
+        titles: titles of the documents
+        rake: extractor returned by createRake, a new one if None
+
+    Returns:
+        list[str]: every occurrence of every keyphrase, in decreasing RAKE score
+    """
+    if rake is None:
+        rake = createRake()
+    rake.extract_keywords_from_sentences(titles)
+    return [phrase for phrase in rake.get_ranked_phrases() if not any(word in phrase for word in stop_words)]
+
+
+def titleKeyphrases(title: str, rake=None):
+    """Distinct keyphrases of one title, see extractKeyphrases
+
+    The "keyphrase" doc values of the index keep each phrase once per
+    document, every count of the trend analytics does the same.
+    """
+    return list(dict.fromkeys(extractKeyphrases([title], rake)))
+
+
+def rankKeyphrases(counts):
+    """[(keyphrase, count)] by decreasing count, ties in alphabetical order"""
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def _countChunk(chunk):
+    group, titles = chunk
+    rake = createRake()
+    counts = Counter()
+    for title in titles:
+        counts.update(titleKeyphrases(title, rake))
+    return group, counts
+
+
+def countKeyphrases(groups: dict, jobs: int = 1, chunkSize: int = 2000):
+    """Count the titles of each group containing each keyphrase, as a map-reduce over a process pool
+
+    RAKE splits every title into phrases on its own, so counts of chunks add
+    up to the counts of the whole group and the result does not depend on
+    jobs or chunkSize.
+
+    Args:
+        groups: group, e.g. a year -> list of titles
+        jobs: number of worker processes, 1 counts in this process
+        chunkSize: number of titles sent to a worker at once
+
+    Returns:
+        dict: group -> Counter of keyphrases, by number of titles
+    """
+    chunks = [(group, titles[i:i + chunkSize]) for group, titles in groups.items()
+              for i in range(0, len(titles), chunkSize)]
+    counts = {group: Counter() for group in groups}
+    if jobs <= 1 or len(chunks) <= 1:
+        for group, partial in map(_countChunk, chunks):
+            counts[group].update(partial)
+        return counts
+
+    # spawn, the parent may hold a running JVM that cannot be forked
+    with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for group, partial in pool.map(_countChunk, chunks):
+            counts[group].update(partial)
+    return counts
@@ -0,0 +1,134 @@
+import json
+import resource
+import threading
+import time
+from collections import deque
+
+from lucene import JavaError
+from org.apache.lucene.index import SegmentInfos
+
+
+class IndexMetrics(object):
+    """Counters and timers of an index build, reported as a JSON dict
+
+    Timers are accumulated by the caller with time.perf_counter deltas:
+        * parse: reading the next record from the XML stream
+        * build: filling the lucene Document of the record
+        * add: addDocument/updateDocument, or the hand-off to the worker pool
+    """
+
+    def __init__(self):
+        self.timers = {"parse": 0.0, "build": 0.0, "add": 0.0}
+        self.docs = 0
+        self.flushes = 0
+        self.peakRamBytes = 0
+        self.checkpoints = []
+        self.segments = None
+        self.merges = None
+        self.addedSegments = 0
+        self.baseCounter = 0
+        self.startTime = time.time()
+        self.endTime = None
+        self._ramDocs = 0
+
+    def begin(self, writer):
+        """Remember the segment name counter of an appended index, call it before indexing"""
+        try:
+            self.baseCounter = int(SegmentInfos.readLatestCommit(writer.getDirectory()).counter)
+        except JavaError:
+            # no commit yet, the index is created from scratch
+            self.baseCounter = 0
+
+    def sample(self, writer):
+        """Read the RAM buffer state of the writer, call it every few hundred documents
+
+        The number of buffered documents only goes down when a segment is flushed.
+        """
+        self.peakRamBytes = max(self.peakRamBytes, writer.ramBytesUsed())
+        ramDocs = writer.numRamDocs()
+        if ramDocs < self._ramDocs:
+            self.flushes += 1
+        self._ramDocs = ramDocs
+
+    def checkpoint(self, percent: int):
+        """Record the elapsed time and number of documents at percent of the input"""
+        self.checkpoints.append({"percent": percent, "docs": self.docs, "elapsed": time.time() - self.startTime})
+
+    def finish(self, writer):
+        """Collect the segment statistics, call it after the final commit of writer"""
+        self.endTime = time.time()
+        if self._ramDocs:
+            # the final commit flushed what was left in the buffer
+            self.flushes += 1
+        infos = SegmentInfos.readLatestCommit(writer.getDirectory())
+        self.segments = infos.size()
+        # every flush, every merge and every segment copied by addIndexes
+        # allocates a new segment name
+        self.merges = max(int(infos.counter) - self.baseCounter - self.flushes - self.addedSegments, 0)
+
+    def report(self):
+        elapsed = (self.endTime or time.time()) - self.startTime
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            "docs": self.docs,
+            "elapsed": elapsed,
+            "docs_per_sec": self.docs / elapsed if elapsed > 0 else 0.0,
+            "timers": dict(self.timers),
+            "peak_ram_buffer_bytes": self.peakRamBytes,
+            "flushes": self.flushes,
+            "merges": self.merges,
+            "segments": self.segments,
+            # ru_maxrss is in kilobytes on linux, the JVM lives in this process
+            "peak_rss_bytes": usage.ru_maxrss * 1024,
+            "peak_rss_children_bytes": children.ru_maxrss * 1024,
+            "checkpoints": self.checkpoints,
+        }
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.report(), file, indent=2)
+
+
+class LatencyStats(object):
+    """Thread-safe latencies of served queries, reported as throughput and percentiles
+
+    Percentiles are computed over the last window latencies, counters cover all of them.
+    """
+
+    def __init__(self, window: int = 100000):
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.startTime = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, error: bool = False):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.count += 1
+            if error:
+                self.errors += 1
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            count, errors = self.count, self.errors
+        elapsed = time.time() - self.startTime
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            # nearest rank
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+        return {
+            "queries": count,
+            "errors": errors,
+            "elapsed": elapsed,
+            "queries_per_sec": count / elapsed if elapsed > 0 else 0.0,
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(50),
+            "p99": percentile(99),
+            "max": latencies[-1] if latencies else 0.0,
+        }
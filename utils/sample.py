@@ -0,0 +1,71 @@
+import random
+from xml.sax.saxutils import escape
+
+
+VENUES = [
+    ("conf", "aaai", "AAAI"),
+    ("conf", "ijcai", "IJCAI"),
+    ("conf", "cvpr", "CVPR"),
+    ("conf", "acl", "ACL"),
+    ("conf", "sigir", "SIGIR"),
+    ("journals", "tkde", "IEEE Trans. Knowl. Data Eng."),
+    ("journals", "pami", "IEEE Trans. Pattern Anal. Mach. Intell."),
+    ("journals", "jmlr", "J. Mach. Learn. Res."),
+]
+
+WORDS = [
+    "learning", "neural", "graph", "language", "models", "reinforcement", "vision",
+    "retrieval", "search", "efficient", "scalable", "knowledge", "reasoning", "multi-agent",
+    "planning", "transformer", "representation", "detection", "segmentation", "query",
+    "index", "distributed", "optimization", "bayesian", "inference", "robust", "adversarial",
+]
+
+NAMES = [
+    "Alice", "Bob", "Carol", "David", "Erin", "Frank", "Grace", "Heidi", "Ivan",
+    "Judy", "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil", "Trent", "Wei",
+]
+
+
+def writeSyntheticDblp(path: str, records: int, seed: int = 0):
+    """Write a small dblp-like XML file, used to benchmark the indexer without the dump
+
+    The output is deterministic for a given (records, seed) and needs no DTD.
+
+    Args:
+        path: output file
+        records: number of article/inproceedings records
+        seed: seed of the random generator
+
+    Returns:
+        str: path
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="ISO-8859-1") as file:
+        file.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<dblp>\n')
+        for number in range(records):
+            kind, venue, name = rng.choice(VENUES)
+            year = rng.randint(2000, 2023)
+            tag = "inproceedings" if kind == "conf" else "article"
+            key = f"{kind}/{venue}/{year}-{number}"
+            mdate = f"{rng.randint(2015, 2023)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))).capitalize() + "."
+
+            file.write(f'<{tag} mdate="{mdate}" key="{key}">\n')
+            for _ in range(rng.randint(1, 5)):
+                author = f"{rng.choice(NAMES)} {rng.choice(NAMES)}son"
+                file.write(f"<author>{escape(author)}</author>\n")
+            file.write(f"<title>{escape(title)}</title>\n")
+            first = rng.randint(1, 900)
+            file.write(f"<pages>{first}-{first + rng.randint(4, 12)}</pages>\n")
+            file.write(f"<year>{year}</year>\n")
+            if kind == "conf":
+                file.write(f"<booktitle>{escape(name)}</booktitle>\n")
+                file.write(f"<crossref>{kind}/{venue}/{year}</crossref>\n")
+            else:
+                file.write(f"<journal>{escape(name)}</journal>\n")
+                file.write(f"<volume>{year - 1990}</volume>\n")
+            file.write(f"<ee>https://doi.org/10.0000/{venue}.{year}.{number}</ee>\n")
+            file.write(f"<url>db/{kind}/{venue}/{venue}{year}.html#{number}</url>\n")
+            file.write(f"</{tag}>\n")
+        file.write("</dblp>\n")
+    return path
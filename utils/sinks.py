@@ -0,0 +1,79 @@
+import json
+import sys
+
+
+def asDict(result):
+    """A search result as a dict, namedtuple results drop their missing fields"""
+    if isinstance(result, dict):
+        return result
+    return {name: value for name, value in result._asdict().items() if value is not None}
+
+
+class ResultSink(object):
+    """Receives the results of one search as they are converted, see Searher.printResult
+
+    begin is called before the first result and end once the search is done,
+    also when the consumer of a lazy search stops early.
+    """
+
+    def begin(self, name: str, limit):
+        """
+        Args:
+            name: name of the search, e.g. "keyword-graph"
+            limit: number of results requested, None for all of them
+        """
+
+    def write(self, rank: int, docId: int, score: float, result):
+        """Receive one result, rank starts at 1"""
+
+    def end(self, count: int, elapsed: float):
+        """
+        Args:
+            count: number of results written
+            elapsed: seconds since begin
+        """
+
+
+class ConsoleSink(ResultSink):
+    """Print every result with its doc id, score and rank, then the elapsed time"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def begin(self, name, limit):
+        print('*'*5, limit if limit is not None else 'all', 'documents requested, converting', '*'*5, file=self.stream)
+
+    def write(self, rank, docId, score, result):
+        print(f'DocID: {docId}', file=self.stream)
+        print(f'Score: {score}', file=self.stream)
+        print(f'Rank: {rank}', file=self.stream)
+        for key, value in asDict(result).items():
+            if key == "key" or key == "mdate":
+                continue
+            elif key == "author":
+                print(f"{key}: {(', '.join(value))}", file=self.stream)
+            else:
+                print(f"{key}: {value}", file=self.stream)
+        print(file=self.stream)
+
+    def end(self, count, elapsed):
+        print(f"Elapsed time: {elapsed:6f} seconds", file=self.stream)
+
+
+class JsonLinesSink(ResultSink):
+    """Write every result as one JSON line of path, the results are never held in memory"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def begin(self, name, limit):
+        self.file = open(self.path, "w", encoding="utf-8")
+
+    def write(self, rank, docId, score, result):
+        self.file.write(json.dumps(asDict(result)) + '\n')
+
+    def end(self, count, elapsed):
+        if self.file is not None:
+            self.file.close()
+            self.file = None